@@ -0,0 +1,20 @@
+# Read by gunicorn from the directory it is started in.
+import os
+
+import mensable
+from mensable.metrics import retire_worker
+
+# The app reads WEB_THREADS too, to keep its password hashing queue shorter
+# than this.
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# Do the app's slow one-off setup once in the master process rather than in
+# every worker; see mensable.preload.
+mensable.preload()
+
+
+def child_exit(server, worker):
+    # Keep an exited worker's counts in the /metrics totals.
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        retire_worker(directory, worker.pid)
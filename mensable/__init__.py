@@ -1,16 +1,76 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 import os
+import time
 
 db = SQLAlchemy()
 
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only enforces foreign keys, and so only cascades deletes along
+    # them, when asked to on each connection.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def preload():
+    """Import the app's modules and set up its models, without creating an
+    app or connecting to a database. gunicorn.conf.py calls this in the
+    gunicorn master process, so that workers are forked with this work done
+    and only have to run create_app."""
+    from sqlalchemy.orm import configure_mappers
+    from mensable import (auth, api, cleanup, export, fragments, jobs,
+            metrics, migrations, progress, quiz_api, sqllog, words)
+    configure_mappers()
+
+
 def create_app(test_config=None):
+    started = time.perf_counter()
     app = Flask(__name__, instance_relative_config=True)
     app.config["TEMPLATES_AUTO_RELOAD"] = True
     app.config["SESSION_PERMANENT"] = False
-    app.config["SESSION_TYPE"] = "filesystem"
     app.config["SECRET_KEY"] = "dev"
     app.config["UPLOAD_FOLDER"] = "static/files"
+    # Number of rows on each page of the table, language and word listings.
+    app.config["PAGE_SIZE"] = 50
+    # Per-process cache of word pairs (see mensable/words.py).
+    app.config["WORD_PAIR_CACHE_SIZE"] = 10000
+    app.config["WORD_PAIR_CACHE_TTL"] = 300
+    # Per-process cache of rendered page fragments (see mensable/fragments.py).
+    app.config["FRAGMENT_CACHE_SIZE"] = 1000
+    # Mixed into page ETags; change it on deploys that change templates so
+    # that browsers fetch the new pages.
+    app.config["ETAG_SALT"] = os.getenv("ETAG_SALT", "")
+    # Threads per gunicorn worker, also read by gunicorn.conf.py.
+    app.config["WEB_THREADS"] = int(os.getenv("WEB_THREADS", 4))
+    # Password hashing (see mensable/hashing.py). By default a worker turns
+    # logins away while all but one of its threads are waiting for hashes,
+    # keeping the last free to serve pages; 0 or less means no limit.
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD",
+            "scrypt")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS",
+            2))
+    app.config["PASSWORD_HASH_QUEUE_LIMIT"] = int(os.getenv(
+            "PASSWORD_HASH_QUEUE_LIMIT", app.config["WEB_THREADS"] - 1))
+    # Where quizzes in progress are kept (see mensable/quiz_state.py).
+    app.config["QUIZ_STATE_BACKEND"] = "sql"
+    app.config["QUIZ_STATE_TTL"] = 3600
+    # Shared directory for combining the metrics of several workers, and how
+    # often each worker writes to it (see mensable/metrics.py).
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR")
+    app.config["METRICS_DUMP_INTERVAL"] = 5
+    # Threads per worker for background jobs, how long a job may wait or go
+    # without a heartbeat before it is resumed, and how often each worker
+    # looks for such jobs (see mensable/jobs.py).
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", 2))
+    app.config["JOB_STALE_SECONDS"] = 60
+    app.config["JOB_SWEEP_SECONDS"] = 15
+    # Logging of slow and sampled SQL statements (see mensable/sqllog.py).
+    app.config["SQL_SLOW_QUERY_MS"] = float(os.getenv("SQL_SLOW_QUERY_MS", 200))
+    app.config["SQL_LOG_SAMPLE_RATE"] = float(os.getenv("SQL_LOG_SAMPLE_RATE", 0))
+    app.config["SQL_LOG_REDACT"] = os.getenv("SQL_LOG_REDACT", "1") != "0"
 
     if test_config:
         app.config.from_mapping(test_config)
@@ -20,15 +80,51 @@ def create_app(test_config=None):
         if uri.startswith("postgres://"):
             uri = uri.replace("postgres://", "postgresql://")
         app.config["SQLALCHEMY_DATABASE_URI"] = uri
-        app.config["SQLALCHEMY_ECHO"] = True
 
-    from mensable import auth, api
+    configured = time.perf_counter()
+    from mensable import (auth, api, cleanup, export, fragments, jobs,
+            metrics, migrations, progress, quiz_api, sqllog, words)
+    from mensable.hashing import password_hasher
+    from mensable.quiz_state import quiz_store
+    imported = time.perf_counter()
 
     app.register_blueprint(auth.bp)
     app.register_blueprint(api.bp)
+    app.register_blueprint(export.bp)
+    app.register_blueprint(jobs.bp)
+    app.register_blueprint(progress.bp)
+    app.register_blueprint(quiz_api.bp)
+    registered = time.perf_counter()
 
     db.init_app(app)
     with app.app_context():
-        db.create_all()
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", enable_foreign_keys)
+    metrics.init_app(app)
+    sqllog.init_app(app)
+    migrations.init_app(app)
+    cleanup.init_app(app)
+    jobs.init_app(app)
+    words.init_app(app)
+    fragments.init_app(app)
+    quiz_store.init_app(app)
+    password_hasher.init_app(app)
+    with app.app_context():
+        # Skips DDL unless the schema is out of date (see migrations.py).
+        app.extensions["schema"] = schema = migrations.init_schema()
+    finished = time.perf_counter()
+
+    # Startup time by phase, in milliseconds.
+    app.extensions["startup_timings"] = timings = {
+        "config": (configured - started) * 1000,
+        "imports": (imported - configured) * 1000,
+        "blueprints": (registered - imported) * 1000,
+        "database": (finished - registered) * 1000,
+        "total": (finished - started) * 1000,
+    }
+    app.logger.info("Started in %.0fms (%s); schema %s", timings["total"],
+            ", ".join(f"{phase} {ms:.0f}ms" for phase, ms in timings.items()
+                if phase != "total"), schema)
 
     return app
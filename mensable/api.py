@@ -1,13 +1,26 @@
-from flask import flash, render_template, request, session, redirect, Blueprint
-import os
+from flask import (flash, render_template, request, session, redirect,
+        Blueprint, current_app, make_response)
 import csv
-import Levenshtein
-import sys
+import hashlib
+import io
 from datetime import date
-from random import shuffle
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import joinedload, undefer
 
 from mensable.models import *
 from mensable.auth import login_required
+from mensable.cleanup import (collect_orphan_word_pairs,
+        delete_orphan_word_pairs)
+from mensable.fragments import (bump_language_version, bump_table_version,
+        cached_fragment, languages_version, render_fragment)
+from mensable.jobs import job_handler, job_runner, record_progress
+from mensable.leitner import (add_words_to_subscriptions, due_count_column,
+        subscribe, utcnow)
+from mensable.quiz_state import quiz_store
+from mensable.quizzes import (finish_quiz, finish_review, last_results,
+        mark_answer, start_quiz, start_review)
+from mensable.search import index_word_pairs, search_word_pairs
+from mensable.words import WordPairSnapshot, invalidate_word_pairs
 
 bp = Blueprint("api", __name__)
 
@@ -16,14 +29,74 @@ bp = Blueprint("api", __name__)
 @login_required
 def home():
     """Render homepage - including lists of languages and tables a user is
-    subscribed to."""
+    subscribed to, with the number of words due for review in each, most
+    first."""
     user = User.query.filter_by(id=session["user_id"]).first()
-    subs = user.subscriptions
-    subs.sort(key=lambda sub: sub.last_quiz_date)
+    due_count = due_count_column(utcnow()).label("due_count")
+    rows = (db.session.query(Subscription, due_count)
+            .filter(Subscription.learner_id == user.id)
+            .options(joinedload(Subscription.table).joinedload(Table.language))
+            .order_by(due_count.desc(), Subscription.id)
+            .all())
+    subs = [sub for sub, _ in rows]
+    due = {sub.id: count for sub, count in rows}
     languages = set(sub.table.language for sub in subs)
     today = date.today()
-    return render_template("home.html", user=user, subs=subs,
-            languages=languages, date=today)
+    return render_template("home.html", user=user, subs=subs, due=due,
+            total_due=sum(due.values()), languages=languages, date=today)
+
+
+def keyset_page(query, column, after, key=lambda row: row.id):
+    """Return one page of results from `query` in order of `column`, along
+    with the cursor for the next page (None on the last page).
+
+    The page starts after the value `after` of `column` (None for the first
+    page), usually the "after" request argument, so each page is read with
+    an index range scan and costs the same however deep it is. `key`
+    extracts that value from a result row.
+
+    Pages are shown with pagination.html, which takes the cursors and the
+    page's URL from the view rather than from the request, since it is
+    rendered into fragments shared by every request for the page."""
+    page_size = current_app.config["PAGE_SIZE"]
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(page_size + 1).all()
+    if len(rows) > page_size:
+        return rows[:page_size], key(rows[page_size - 1])
+    return rows, None
+
+
+def page_etag(*versions):
+    """Return a strong ETag for a page that only changes when one of
+    `versions` (e.g. a table's id and version) does."""
+    key = repr((current_app.config["ETAG_SALT"],) + versions)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def not_modified(etag):
+    """Return a 304 Not Modified response if the client already has the page
+    with this ETag, otherwise None. Pages with flashed messages waiting are
+    always sent in full so that the messages are shown."""
+    if etag in request.if_none_match and not session.get("_flashes"):
+        return with_etag(current_app.response_class(status=304), etag)
+    return None
+
+
+def with_etag(response, etag):
+    """Add an ETag to a page, which browsers must revalidate before reuse.
+    Pages are private as they are only shown to logged-in users."""
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def table_words_query(table):
+    """Query for the word pairs in a table, for use with keyset_page."""
+    return (WordPair.query
+            .join(table_word_pair, table_word_pair.c.word_pair_id == WordPair.id)
+            .filter(table_word_pair.c.table_id == table.id))
 
 
 @bp.route("/tables")
@@ -31,22 +104,66 @@ def home():
 @login_required
 def tables(language_name=None):
     """List all tables, or optionally all tables in a given language"""
+    after = request.args.get("after", type=int)
     if not language_name:
-        tables = Table.query.all()
-        return render_template("all_tables.html", tables=tables)
+        version = languages_version()
+        etag = page_etag("all_tables", version, after)
+        response = not_modified(etag)
+        if response:
+            return response
+
+        def render():
+            tables, next_after = keyset_page(Table.query
+                    .options(joinedload(Table.language),
+                        undefer(Table.subscription_count)), Table.id, after)
+            return render_fragment("fragments/all_tables.html", tables=tables,
+                    page_url="/tables", after=after, next_after=next_after)
+        fragment = cached_fragment(("all_tables", version, after), render)
+        return with_etag(render_template("all_tables.html", fragment=fragment),
+                etag)
     else:
         language = Language.query.filter_by(name=language_name).first()
-        tables = Table.query.filter_by(language_id=language.id)
-        return render_template("tables_in_language.html", tables=tables,
-                language=language)
+        etag = page_etag("tables_in_language", language.id, language.version,
+                after)
+        response = not_modified(etag)
+        if response:
+            return response
+
+        page_url = f"/tables/{language.name}"
+
+        def render():
+            tables, next_after = keyset_page(
+                    Table.query.filter_by(language_id=language.id)
+                    .options(undefer(Table.subscription_count)), Table.id,
+                    after)
+            return render_fragment("fragments/tables_in_language.html",
+                    tables=tables, language=language, page_url=page_url,
+                    after=after, next_after=next_after)
+        fragment = cached_fragment(("tables_in_language", language.id,
+            language.version, page_url, after), render)
+        return with_etag(render_template("tables_in_language.html",
+                language=language, fragment=fragment), etag)
 
 
 @bp.route("/languages")
 @login_required
 def languages():
     """List all languages"""
-    languages = Language.query.all()
-    return render_template("languages.html", languages=languages)
+    after = request.args.get("after", type=int)
+    version = languages_version()
+    etag = page_etag("languages", version, after)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    def render():
+        languages, next_after = keyset_page(
+                Language.query.options(undefer(Language.table_count)),
+                Language.id, after)
+        return render_fragment("fragments/languages.html", languages=languages,
+                page_url="/languages", after=after, next_after=next_after)
+    fragment = cached_fragment(("languages", version, after), render)
+    return with_etag(render_template("languages.html", fragment=fragment), etag)
 
 
 @bp.route("/create_language", methods=["GET", "POST"])
@@ -105,11 +222,11 @@ def create_table(language_name):
         table.creator_id = user.id
         table.language_id = language.id
         db.session.add(table)
+        bump_language_version(language.id)
         db.session.commit()
 
         # Now create a subscription to this table.
-        sub = Subscription(user, table)
-        db.session.add(sub)
+        subscribe(user, table)
         db.session.commit()
         return redirect(f"/edit_table/{language_name}/{table_name}")
 
@@ -126,7 +243,13 @@ def edit_table(language_name, table_name):
         return redirect("/tables")
 
     if request.method == "GET":
-        return render_template("edit_table.html", language=language, table=table)
+        after = request.args.get("after", type=int)
+        words, next_after = keyset_page(table_words_query(table),
+                table_word_pair.c.word_pair_id, after)
+        return render_template("edit_table.html", language=language,
+                table=table, words=words,
+                page_url=f"/edit_table/{language.name}/{table.name}",
+                after=after, next_after=next_after)
 
     elif request.method == "POST":
         # Get word and translation from input form.
@@ -148,26 +271,152 @@ def add_word_pair(foreignWord, translation, table, language):
         return
 
     # Check if word is already in database.
-    existing = WordPair.query.filter_by(foreignWord=foreignWord).first()
-    if existing and existing.language_id == language.id:
+    existing = WordPair.query.filter_by(language_id=language.id,
+            foreignWord=foreignWord).first()
+    if existing:
         flash(f"{foreignWord} is already in the database.")
-        table.words.insert(0, existing)
+        in_table = (db.session.query(table_word_pair)
+                .filter_by(table_id=table.id, word_pair_id=existing.id)
+                .first())
+        if not in_table:
+            db.session.execute(table_word_pair.insert().values(
+                    word_pair_id=existing.id, table_id=table.id))
+            bump_table_version(table.id)
+        add_words_to_subscriptions(table, [existing.id])
         db.session.commit()
+        invalidate_word_pairs([existing.id])
         return
 
     # Enter word pair into database.
     word_pair = WordPair(foreignWord, translation)
     word_pair.language_id = language.id
     db.session.add(word_pair)
-    table.words.insert(0, word_pair)   # Maintain many-to-many relationship.
+    db.session.flush()
+    index_word_pairs([word_pair])
+    # Maintain many-to-many relationship without loading table.words.
+    db.session.execute(table_word_pair.insert().values(
+            word_pair_id=word_pair.id, table_id=table.id))
+    add_words_to_subscriptions(table, [word_pair.id])
+    bump_table_version(table.id)
     db.session.commit()
+    invalidate_word_pairs([word_pair.id])
     return
 
 
+# Number of rows sent to the database per INSERT when importing word pairs.
+IMPORT_BATCH_SIZE = 1000
+
+
+def load_import_state(table, language):
+    """Return a map of each foreign word in the language to the id of its
+    word pair, and the set of ids of the word pairs in the table, for
+    `stage_word_pairs`."""
+    known = {}
+    for word_pair_id, foreignWord in (db.session.query(WordPair.id,
+            WordPair.foreignWord).filter_by(language_id=language.id)
+            .order_by(WordPair.id)):
+        known.setdefault(foreignWord, word_pair_id)
+    in_table = set(word_pair_id for (word_pair_id,) in
+            db.session.query(table_word_pair.c.word_pair_id)
+            .filter(table_word_pair.c.table_id == table.id))
+    return known, in_table
+
+
+def stage_word_pairs(rows, table, language, known, in_table):
+    """Add word pairs to a table without committing, updating `known` and
+    `in_table` (from `load_import_state`) to match, so that further rows can
+    be staged in later transactions. Returns the summary of the rows and the
+    ids of the word pairs linked to the table."""
+    summary = {"added": 0, "reused": 0, "rejected": 0}
+    new_pairs = {}
+    link_ids = []
+    for row in rows:
+        if len(row) != 2:
+            summary["rejected"] += 1
+            continue
+        foreignWord, translation = row[0].strip(), row[1].strip()
+        if not foreignWord or not translation:
+            summary["rejected"] += 1
+            continue
+
+        if foreignWord in known or foreignWord in new_pairs:
+            summary["reused"] += 1
+            word_pair_id = known.get(foreignWord)
+            if word_pair_id is not None and word_pair_id not in in_table:
+                in_table.add(word_pair_id)
+                link_ids.append(word_pair_id)
+            continue
+
+        new_pairs[foreignWord] = {"foreignWord": foreignWord,
+                "translation": translation, "language_id": language.id}
+        summary["added"] += 1
+
+    # A bulk INSERT ... RETURNING sends one multi-row statement per batch and
+    # reads back the new ids, where flushing WordPair objects would send one
+    # INSERT per word pair on SQLite.
+    new_pairs = list(new_pairs.values())
+    for start in range(0, len(new_pairs), IMPORT_BATCH_SIZE):
+        batch = new_pairs[start:start + IMPORT_BATCH_SIZE]
+        ids = dict((foreignWord, word_pair_id) for word_pair_id, foreignWord
+                in db.session.execute(insert(WordPair)
+                    .returning(WordPair.id, WordPair.foreignWord), batch))
+        word_pairs = [WordPairSnapshot(ids[row["foreignWord"]],
+                row["foreignWord"], row["translation"], language.id)
+            for row in batch]
+        index_word_pairs(word_pairs)
+        for word_pair in word_pairs:
+            known[word_pair.foreignWord] = word_pair.id
+            in_table.add(word_pair.id)
+            link_ids.append(word_pair.id)
+
+    # Maintain the many-to-many relationship without loading table.words.
+    for start in range(0, len(link_ids), IMPORT_BATCH_SIZE):
+        db.session.execute(table_word_pair.insert(),
+                [{"word_pair_id": word_pair_id, "table_id": table.id}
+                    for word_pair_id in link_ids[start:start + IMPORT_BATCH_SIZE]])
+        add_words_to_subscriptions(table,
+                link_ids[start:start + IMPORT_BATCH_SIZE])
+
+    if link_ids:
+        bump_table_version(table.id)
+    return summary, link_ids
+
+
+@job_handler("import_csv")
+def import_csv_job(job):
+    """Import the rows of an uploaded CSV file into a table, committing
+    every IMPORT_BATCH_SIZE rows.
+
+    The language's existing word pairs and the table's current contents are
+    loaded once up front, so the number of queries depends on the number of
+    batches rather than the number of rows. The job's result counts the rows
+    that added a new word pair, reused an existing one or were rejected."""
+    table = Table.query.filter_by(id=job.params["table_id"]).first()
+    if not table:
+        raise ValueError("The table has been deleted.")
+    language = Language.query.filter_by(id=table.language_id).first()
+    rows = list(csv.reader(io.StringIO(job.payload)))
+    known, in_table = load_import_state(table, language)
+    summary = dict(job.result or {"added": 0, "reused": 0, "rejected": 0})
+
+    for start in range(job.progress, len(rows), IMPORT_BATCH_SIZE):
+        batch_summary, link_ids = stage_word_pairs(
+                rows[start:start + IMPORT_BATCH_SIZE], table, language, known,
+                in_table)
+        for key, count in batch_summary.items():
+            summary[key] += count
+        record_progress(job, min(start + IMPORT_BATCH_SIZE, len(rows)),
+                len(rows), summary)
+        db.session.commit()
+        invalidate_word_pairs(link_ids)
+    record_progress(job, len(rows), len(rows), summary)
+
+
 @bp.route("/upload_csv/<language_name>/<table_name>", methods=["GET", "POST"])
 @login_required
 def upload_csv(language_name, table_name):
-    """Edit an existing word table by adding words from a csv file"""
+    """Edit an existing word table by adding words from a csv file, in a
+    background job."""
     table = Table.query.filter_by(name=table_name).first()
     language = Language.query.filter_by(name=language_name).first()
 
@@ -176,26 +425,32 @@ def upload_csv(language_name, table_name):
 
     elif request.method == "POST":
         uploaded_file = request.files["csv_file"]
-        filename = os.path.join(uploaded_file.filename)
-        uploaded_file.save(filename)
-        with open(filename) as csv_file:
-            for row in csv.reader(csv_file):
-                if len(row) == 2:
-                    foreignWord, translation = row
-                    add_word_pair(foreignWord, translation, table, language)
-        return redirect(f"/edit_table/{language.name}/{table.name}")
+        job = job_runner.enqueue("import_csv", {"table_id": table.id,
+                "description": f"Importing words into {table.name}",
+                "next": f"/edit_table/{language.name}/{table.name}"},
+            payload=uploaded_file.read().decode("utf-8"))
+        return redirect(f"/jobs/{job.id}")
 
 
 @bp.route("/delete_word/<language_name>/<table_name>", methods=["POST"])
 @login_required
 def delete_word(language_name, table_name):
-    """Delete a word."""
+    """Remove a word from a table, deleting it altogether if no other table
+    contains it."""
     table = Table.query.filter_by(name=table_name).first()
-    language = Language.query.filter_by(name=language_name).first()
-    word_pair_id = request.form["word_pair_id"]
-    word_pair = WordPair.query.filter_by(id=word_pair_id).first()
-    db.session.delete(word_pair)
+    word_pair_id = request.form.get("word_pair_id", type=int)
+    db.session.execute(table_word_pair.delete().where(
+            table_word_pair.c.table_id == table.id,
+            table_word_pair.c.word_pair_id == word_pair_id))
+    # The table's subscribers stop learning the word.
+    LeitnerBox.query.filter(LeitnerBox.word_pair_id == word_pair_id,
+            LeitnerBox.subscription_id.in_(select(Subscription.id)
+                .where(Subscription.table_id == table.id))) \
+            .delete(synchronize_session=False)
+    delete_orphan_word_pairs([word_pair_id])
+    bump_table_version(table.id)
     db.session.commit()
+    invalidate_word_pairs([word_pair_id])
     return redirect(f"/edit_table/{language_name}/{table_name}")
 
 
@@ -207,30 +462,104 @@ def delete_table(language_name, table_name):
     if request.method == "GET":
         return render_template("delete_table.html", table=table)
     elif request.method == "POST":
-        for sub in table.subscriptions:
-            db.session.delete(sub)
-        db.session.delete(table)
+        job = job_runner.enqueue("delete_table", {"table_id": table.id,
+                "description": f"Deleting {table.name}",
+                "next": f"/tables/{language_name}"})
+        return redirect(f"/jobs/{job.id}")
+
+
+@job_handler("delete_table")
+def delete_table_job(job):
+    """Delete a table, then the word pairs that were only in it."""
+    table = Table.query.filter_by(id=job.params["table_id"]).first()
+    if table:
+        # A single statement: the database deletes the table's
+        # subscriptions, their Leitner boxes and its links to word pairs
+        # along with it, and unlinks its quiz history.
+        db.session.execute(delete(Table).where(Table.id == table.id)
+                .execution_options(synchronize_session=False))
+        bump_language_version(table.language_id)
+        record_progress(job, 1, 2)
         db.session.commit()
-        return redirect(f"/tables/{language_name}")
+    # Heartbeats with every batch, so a long collection is not resumed
+    # elsewhere.
+    collected = collect_orphan_word_pairs(on_batch=lambda collected:
+            record_progress(job, 1, 2, {"deleted_word_pairs": collected}))
+    record_progress(job, 2, 2, {"deleted_word_pairs": collected})
 
 
 @bp.route("/view_table/<language_name>/<table_name>", methods=["GET"])
 @login_required
 def view_table(language_name, table_name):
     """View an existing word table"""
-    user = User.query.filter_by(id=session["user_id"]).first()
-    table = Table.query.filter_by(name=table_name).first()
+    table = (Table.query.filter_by(name=table_name)
+            .options(joinedload(Table.creator), joinedload(Table.language))
+            .first())
 
     if not table:
         flash(f"Table {table_name} does not exist")
         return redirect("/")
 
-    if not table.words:
+    # Besides the table, the page depends on who is viewing it and on their
+    # subscription, which changes after every quiz.
+    sub = Subscription.query.filter_by(learner_id=session["user_id"],
+            table_id=table.id).first()
+    after = request.args.get("after", type=int)
+    etag = page_etag("view_table", table.id, table.version, after,
+            session["user_id"], sub and (sub.id, sub.quiz_attempts))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # The list of words is the same for every user, so is cached; whether
+    # the user is subscribed and their scores are not.
+    page_url = f"/view_table/{table.language.name}/{table.name}"
+
+    def render():
+        words, next_after = keyset_page(table_words_query(table),
+                table_word_pair.c.word_pair_id, after)
+        return bool(words), render_fragment("fragments/table_words.html",
+                words=words, page_url=page_url, after=after,
+                next_after=next_after)
+    has_words, fragment = cached_fragment(("table_words", table.id,
+        table.version, page_url, after), render)
+    if not has_words and after is None:
         flash(f"Table {table_name} is empty, try editing it here")
         return redirect(f"/edit_table/{language_name}/{table_name}")
 
-    sub = Subscription.query.filter_by(learner_id=user.id, table_id=table.id).first()
-    return render_template("view_table.html", table=table, user=user, sub=sub)
+    user = User.query.filter_by(id=session["user_id"]).first()
+    return with_etag(render_template("view_table.html", table=table, user=user,
+            sub=sub, fragment=fragment), etag)
+
+
+@bp.route("/search")
+@login_required
+def search():
+    """Find word pairs whose word or translation is close to a query,
+    optionally only in a given language or table."""
+    query = request.args.get("q", "").strip()
+    language_name = request.args.get("language", "").strip()
+    table_name = request.args.get("table", "").strip()
+
+    results = []
+    if query:
+        language = table = None
+        if language_name:
+            language = Language.query.filter_by(name=language_name).first()
+        if table_name:
+            table = Table.query.filter_by(name=table_name).first()
+        if language_name and not language:
+            flash(f"The language {language_name} does not exist.")
+        elif table_name and not table:
+            flash(f"Table {table_name} does not exist.")
+        else:
+            results = search_word_pairs(query,
+                    language_id=language.id if language else None,
+                    table_id=table.id if table else None)
+
+    return render_template("search.html", query=query,
+            language_name=language_name, table_name=table_name,
+            results=results)
 
 
 @bp.route("/quiz/<language_name>/<table_name>", methods=["GET", "POST"])
@@ -238,100 +567,101 @@ def view_table(language_name, table_name):
 def quiz(language_name, table_name):
     """Test a user's knowledge of the words in a table with a randomized quiz"""
 
-    QUIZ_LENGTH = 6
     table = Table.query.filter_by(name=table_name).first()
+    quiz = load_quiz()
+    if quiz is not None and quiz["table_id"] != table.id:
+        quiz = None
 
     if request.method == "GET":
-        user = User.query.filter_by(id=session["user_id"]).first()
-
-        if "quiz" not in session or session["quiz"]["table_id"] != table.id:
-            # Create quiz dictionary session variable.
-            session["quiz"] = {}
-            quiz = session["quiz"] # (alias)
-
-            # Check if user is subscribed to table yet.
-            sub = Subscription.query.filter_by(learner_id=user.id, table_id=table.id).first()
-
-            # Create subscription if not.
-            if not sub:
-                sub = Subscription(user, table)
-
-            # Update leitner boxes, checking for new and deleted words in list
-            lboxes = sub.leitner_boxes.copy()
-            database_word_ids = [word_pair.id for word_pair in table.words] 
-            for word_id in database_word_ids:
-                if word_id not in lboxes:
-                    lboxes[word_id] = 0
-            for word_id in list(lboxes.keys()):
-                if word_id not in database_word_ids:
-                    del lboxes[word_id]
-            sub.leitner_boxes = lboxes
-            db.session.add(sub)
-            db.session.commit()
-
-            # Load list of "QUIZ_LENGTH" highest-prioirity word pair IDs to learn from
-            # Leitner boxes. 
-            word_ids = list(lboxes.keys())
-            word_ids.sort(key=lambda id: lboxes[id])
-            word_ids = word_ids[:QUIZ_LENGTH]
-            shuffle(word_ids)
-            quiz["total_count"] = len(word_ids)
-            quiz["word_ids"] = word_ids
-            quiz["to_test"] = word_ids.copy()
-            quiz["right_list"] = []
-            quiz["wrong_list"] = []
-            quiz["right_count"] = 0
-            quiz["table_id"] = table.id 
+        if quiz is None:
+            # Create quiz dictionary, stored server-side by quiz_store.
+            user = User.query.filter_by(id=session["user_id"]).first()
+            session["quiz_id"] = quiz_store.create(start_quiz(user, table))
             
             # Start quiz by redirecting back to the route.
             return redirect(f"/quiz/{language_name}/{table_name}")
 
         else:
-            quiz = session["quiz"]
-
             if len(quiz["to_test"]) == 0:
                 return redirect(f"/results/{language_name}/{table_name}")
 
             # Otherwise ask user to translate current first word in the list.
-            word_id = quiz["to_test"][0]
-            word_pair = WordPair.query.filter_by(id=word_id).first()
-            return render_template("quiz.html", table=table,
+            word_pair = quiz["to_test"][0]
+            return render_template("quiz.html",
+                    action=f"/quiz/{language_name}/{table_name}",
                     word_pair=word_pair)
 
     elif request.method == "POST":
-        print("\n\n QUIZ = ", session["quiz"], file=sys.stderr)
-        word_id = session["quiz"]["to_test"][0]
-        session["quiz"]["to_test"] = session["quiz"]["to_test"][1:]
-        print("\n\n QUIZ = ", session["quiz"], file=sys.stderr)
-        word_pair = WordPair.query.filter_by(id=word_id).first()
-        answer = request.form["answer"]
-
-        # Compare answer to translation from database and record results.
-        if compare_strings(answer, word_pair.translation):
-            flash(f"Correct: {word_pair.foreignWord} translates to {word_pair.translation}.")
-            session["quiz"]["right_list"].append(word_id)
-            session["quiz"]["right_count"] += 1
-            print("\n\n QUIZ = ", session["quiz"], file=sys.stderr)
-            session.modified = True
+        if quiz is None or not quiz["to_test"]:
+            # The quiz has expired or is finished, so start again.
             return redirect(f"/quiz/{language_name}/{table_name}")
-        else:
-            session["quiz"]["wrong_list"].append(word_id)
-            print("\n\n QUIZ = ", session["quiz"], file=sys.stderr)
-            session.modified = True
-            return render_template("wrong.html", table=table,
-                    word_pair=word_pair, answer=answer)
+        return answer_question(quiz, f"/quiz/{language_name}/{table_name}")
+
+
+@bp.route("/review", defaults={"language_name": None},
+        methods=["GET", "POST"])
+@bp.route("/review/<language_name>", methods=["GET", "POST"])
+@login_required
+def review(language_name):
+    """Quiz a user on the most overdue words of all the tables they are
+    subscribed to, or of those in one language."""
+    route = f"/review/{language_name}" if language_name else "/review"
+    quiz = load_quiz()
+    if quiz is not None and quiz.get("review") != (language_name or ""):
+        quiz = None
+
+    if request.method == "GET":
+        if quiz is None:
+            language = None
+            if language_name:
+                language = Language.query.filter_by(name=language_name).first()
+                if not language:
+                    flash(f"Language {language_name} does not exist")
+                    return redirect("/")
+            user = User.query.filter_by(id=session["user_id"]).first()
+            quiz = start_review(user, language)
+            if not quiz["to_test"]:
+                flash("There are no words to review yet - subscribe to a "
+                        "table first.")
+                return redirect("/")
+            session["quiz_id"] = quiz_store.create(quiz)
+            return redirect(route)
+
+        if not quiz["to_test"]:
+            return redirect("/review_results")
+        return render_template("quiz.html", action=route,
+                word_pair=quiz["to_test"][0])
+
+    elif request.method == "POST":
+        if quiz is None or not quiz["to_test"]:
+            return redirect(route)
+        return answer_question(quiz, route)
+
+
+def answer_question(quiz, route):
+    """Mark the posted answer to the quiz's current question, then send the
+    user back to the quiz at `route` or show them the right answer."""
+    word_pair = quiz["to_test"][0]
+    quiz["to_test"] = quiz["to_test"][1:]
+    answer = request.form["answer"]
+
+    # Compare answer to translation and record results.
+    correct = mark_answer(quiz, word_pair, answer)
+    quiz_store.save(session["quiz_id"], quiz)
+    if correct:
+        flash(f"Correct: {word_pair['foreignWord']} translates to {word_pair['translation']}.")
+        return redirect(route)
+    else:
+        return render_template("wrong.html", action=route,
+                word_pair=word_pair, answer=answer)
 
 
-def compare_strings(s1, s2):
-    """Soft string comparison, converts to lower case and removes whitespace,
-    allows for typos up to a Levenshtein distance of 2"""
-    s1 = s1.lower()
-    s2 = s2.lower()
-    s1 = s1.replace(" ", "")
-    s2 = s2.replace(" ", "")
-    if Levenshtein.distance(s1, s2) <= 2:
-        return True
-    return False
+def load_quiz():
+    """Return the current user's quiz in progress, or None."""
+    quiz_id = session.get("quiz_id")
+    if quiz_id is None:
+        return None
+    return quiz_store.get(quiz_id)
 
 
 @bp.route("/results/<language_name>/<table_name>", methods=["GET"])
@@ -342,59 +672,34 @@ def results(language_name, table_name):
     table = Table.query.filter_by(name=table_name).first()
     sub = Subscription.query.filter_by(learner_id=user.id, table_id=table.id).first()
 
-    if "quiz" not in session:
-        results = sub.last_quiz_results
+    quiz = load_quiz()
+    if quiz is None or quiz["table_id"] != table.id:
+        results = last_results(sub)
 
     else:
-        quiz = session["quiz"]
-
-        # Upate Leitner boxes
-        lboxes = sub.leitner_boxes.copy()
-        for word_id in quiz["right_list"]:
-            # Move to next box along
-            lboxes[word_id] += 1
-        for word_id in quiz["wrong_list"]:
-            # Move back to first box
-            lboxes[word_id] = 0
-        sub.leitner_boxes = lboxes 
-
-        # Tidy up
-        db.session.commit()
-        del session["quiz"]
-
-        # Convert quiz data into more detailed results dictionary
-        results = quiz.copy()
-        results["wrong_list"] = [WordPair.query.filter_by(id=id).first() for id in
-                quiz["wrong_list"]]
-        results["right_list"] = [WordPair.query.filter_by(id=id).first() for id in
-                quiz["right_list"]]
-        results["percentage_score"] = int(results["right_count"] /
-                results["total_count"] * 100)
-        if results["percentage_score"] > 90:
-            headline = "Congrats! "
-        elif results["percentage_score"] > 60:
-            headline = "Not bad! "
-        else:
-            headline = "Better luck next time - "
-        
-        headline += f"""
-                   you scored {results['right_count']}/{results['total_count']}
-                   ({results['percentage_score']}%)
-                   """
-        results["headline"] = headline
-
-        # Save full details of most recent results to the subscription
-        sub.last_quiz_results = results
-        sub.quiz_attempts += 1
-        sub.total_questions += results["total_count"]
-        sub.total_right += results["right_count"]
-        sub.average_percentage_score = int(sub.total_right /
-                sub.total_questions * 100)
-        sub.last_quiz_date = date.today()
-        db.session.commit()
+        # Update Leitner boxes and statistics, then tidy up.
+        results = finish_quiz(sub, quiz)
+        quiz_store.delete(session.pop("quiz_id"))
 
     # Display results
-    return render_template("results.html", results=results, sub=sub)
+    return render_template("results.html", results=results, sub=sub,
+            continue_url=f"/quiz/{language_name}/{table_name}")
+
+
+@bp.route("/review_results", methods=["GET"])
+@login_required
+def review_results():
+    """Apply a finished review quiz to every subscription it drew words
+    from, and show its results."""
+    quiz = load_quiz()
+    if quiz is None or "review" not in quiz or quiz["to_test"]:
+        return redirect("/review")
+
+    results = finish_review(quiz)
+    quiz_store.delete(session.pop("quiz_id"))
+    route = f"/review/{quiz['review']}" if quiz["review"] else "/review"
+    return render_template("results.html", results=results, sub=None,
+            continue_url=route)
 
 
 @bp.route("/unsubscribe/<language_name>/<table_name>", methods=["GET", "POST"])
@@ -410,6 +715,8 @@ def unsubscribe(language_name, table_name):
 
     elif request.method == "POST":
         db.session.delete(sub)
+        bump_table_version(table.id)
+        bump_language_version(table.language_id)
         db.session.commit()
         return redirect(f"/tables/{language_name}")
 
@@ -1,12 +1,18 @@
 from flask import flash, render_template, request, session, redirect, Blueprint
-from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
 
+from mensable.hashing import HashingBusy, password_hasher
 from mensable.models import *
 
 bp = Blueprint("auth", __name__)
 
 
+def busy(template):
+    """Re-render a form when there is no capacity to hash its password."""
+    flash("The server is busy - please try again in a moment.")
+    return render_template(template), 503
+
+
 def login_required(f):
     """
     Decorate routes to require login.
@@ -46,9 +52,22 @@ def login():
             flash("Username not recognized - try again or register for an account.")
             return redirect("/login")
         
-        if not check_password_hash(user.password_hash, password):
-            flash("Incorrect password.")
-            return redirect("/login")
+        try:
+            if not password_hasher.check(user.password_hash, password):
+                flash("Incorrect password.")
+                return redirect("/login")
+        except HashingBusy:
+            return busy("login.html")
+
+        # Upgrade hashes made before the hash method was last changed. The
+        # password is right, so if the hasher is busy the upgrade waits for
+        # another login.
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = password_hasher.hash(password)
+                db.session.commit()
+            except HashingBusy:
+                pass
 
         session["user_id"] = user.id
         return redirect("/")
@@ -79,13 +98,16 @@ def register():
             flash("Password and confirmation must match.")
             return redirect("/register")
 
-        password_hash = generate_password_hash(password)
-        user = User(username, password_hash)
-    
+        user = User(username, None)
         if not user.check_name():
             flash("Username can contain only letters, numbers and underscores.")
             return redirect("/register")
 
+        try:
+            user.password_hash = password_hasher.hash(password)
+        except HashingBusy:
+            return busy("register.html")
+
         db.session.add(user)
         db.session.commit()
         session["user_id"] = user.id
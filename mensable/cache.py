@@ -0,0 +1,61 @@
+"""A small thread-safe LRU cache for data shared between requests in one
+worker process."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Maps keys to values, evicting the least recently used entry once
+    `maxsize` entries are held. Entries older than `ttl` seconds are treated
+    as missing; a `ttl` of None keeps entries until they are evicted. A
+    `maxsize` of 0 disables the cache."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return a dictionary of hit, miss and size counters."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "maxsize": self.maxsize}
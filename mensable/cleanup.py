@@ -0,0 +1,69 @@
+"""Deletion of word pairs that no table contains any more.
+
+Word pairs can be shared by several tables, so deleting a table only removes
+its links to them. `collect_orphan_word_pairs` then deletes the word pairs
+left in no table, ORPHAN_BATCH_SIZE per transaction so that no transaction
+holds its locks for long. Their Leitner boxes and trigram index entries are
+deleted with them by the database (ON DELETE CASCADE).
+
+The job that deletes a table runs a collection afterwards, and
+`flask collect-orphans` runs one from the command line."""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, exists, select
+
+from mensable import db
+from mensable.models import WordPair, table_word_pair
+from mensable.words import invalidate_word_pairs
+
+# Word pairs deleted per transaction.
+ORPHAN_BATCH_SIZE = 1000
+
+
+def orphaned():
+    """Return a condition true of word pairs that are in no table."""
+    return ~exists().where(table_word_pair.c.word_pair_id == WordPair.id)
+
+
+def delete_orphan_word_pairs(word_pair_ids):
+    """Delete those of the word pairs that are in no table, with a single
+    statement. Does not commit. Returns the number deleted."""
+    result = db.session.execute(delete(WordPair)
+            .where(WordPair.id.in_(word_pair_ids), orphaned())
+            .execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def collect_orphan_word_pairs(batch_size=ORPHAN_BATCH_SIZE, on_batch=None):
+    """Delete every word pair that is in no table, committing after each
+    batch. `on_batch`, if given, is called with the number deleted so far
+    before each commit, e.g. to record a job's progress. Returns the number
+    deleted."""
+    collected, after = 0, 0
+    while True:
+        # Each batch carries on in id order from the last, so the word pairs
+        # are read once in all.
+        ids = [word_pair_id for (word_pair_id,) in db.session.execute(
+                select(WordPair.id)
+                .where(WordPair.id > after, orphaned())
+                .order_by(WordPair.id)
+                .limit(batch_size))]
+        if not ids:
+            return collected
+        collected += delete_orphan_word_pairs(ids)
+        if on_batch:
+            on_batch(collected)
+        db.session.commit()
+        invalidate_word_pairs(ids)
+        after = ids[-1]
+
+
+@click.command("collect-orphans")
+@with_appcontext
+def collect_command():
+    """Delete word pairs that are in no table."""
+    click.echo(f"word_pairs: {collect_orphan_word_pairs()}")
+
+
+def init_app(app):
+    app.cli.add_command(collect_command)
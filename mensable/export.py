@@ -0,0 +1,96 @@
+"""Downloads of the word pairs in a table or a whole language.
+
+    GET /export/<language_name>/<table_name>?format=csv
+    GET /export/<language_name>?format=ndjson
+
+CSV files have one "foreignWord,translation" row per word pair, so they can
+be uploaded again with upload_csv. NDJSON files have one JSON object per line.
+Rows are streamed from the database in batches of EXPORT_BATCH_SIZE as the
+response is written, so memory use does not grow with the size of the table."""
+import csv
+import io
+import json
+
+from flask import (Blueprint, Response, flash, redirect, request,
+        stream_with_context)
+from sqlalchemy import select
+
+from mensable import db
+from mensable.auth import login_required
+from mensable.models import Language, Table, WordPair, table_word_pair
+
+bp = Blueprint("export", __name__)
+
+# Rows fetched from the database, and written to the response, at a time.
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def format_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row.foreignWord, row.translation))
+    return buffer.getvalue()
+
+
+def format_ndjson(rows):
+    return "".join(json.dumps({"id": row.id, "foreignWord": row.foreignWord,
+        "translation": row.translation}) + "\n" for row in rows)
+
+
+FORMATTERS = {"csv": format_csv, "ndjson": format_ndjson}
+
+
+def export_response(query, filename):
+    """Stream the rows of a select() of word pair columns as a download in
+    the format named by the "format" request argument."""
+    export_format = request.args.get("format", "csv")
+    if export_format not in FORMATS:
+        return f"Unknown export format {export_format}.", 400
+    formatter = FORMATTERS[export_format]
+
+    def generate():
+        # yield_per fetches the rows in batches, using a server-side cursor
+        # on databases that have them.
+        result = db.session.execute(query.execution_options(
+                yield_per=EXPORT_BATCH_SIZE))
+        for rows in result.partitions():
+            yield formatter(rows)
+
+    return Response(stream_with_context(generate()),
+            mimetype=FORMATS[export_format],
+            headers={"Content-Disposition":
+                f'attachment; filename="{filename}.{export_format}"'})
+
+
+@bp.route("/export/<language_name>/<table_name>")
+@login_required
+def export_table(language_name, table_name):
+    """Download every word pair in a table."""
+    table = Table.query.filter_by(name=table_name).first()
+    if not table:
+        flash(f"Table {table_name} does not exist")
+        return redirect("/")
+
+    query = (select(WordPair.id, WordPair.foreignWord, WordPair.translation)
+            .join(table_word_pair, table_word_pair.c.word_pair_id == WordPair.id)
+            .where(table_word_pair.c.table_id == table.id)
+            .order_by(table_word_pair.c.word_pair_id))
+    return export_response(query, table.name)
+
+
+@bp.route("/export/<language_name>")
+@login_required
+def export_language(language_name):
+    """Download every word pair in a language, whichever tables it is in."""
+    language = Language.query.filter_by(name=language_name).first()
+    if not language:
+        flash(f"Language {language_name} does not exist")
+        return redirect("/")
+
+    query = (select(WordPair.id, WordPair.foreignWord, WordPair.translation)
+            .where(WordPair.language_id == language.id)
+            .order_by(WordPair.id))
+    return export_response(query, language.name)
@@ -0,0 +1,60 @@
+"""Cache of rendered page fragments that look the same to every user.
+
+Tables and languages have a `version` that is increased whenever something
+shown in their listings changes: `bump_table_version` when a table's words or
+subscriber count change, and `bump_language_version` when tables are added to
+or removed from a language, or its tables' subscriber counts change.
+Fragments are cached under keys that include these versions, so a change is
+seen by every worker at once: entries for older versions are never asked for
+again, and are evicted from the LRU cache in time.
+
+Anything that depends on the user viewing the page, such as their
+subscription statistics, must be rendered outside the cached fragment."""
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import func
+
+from mensable import db
+from mensable.cache import LRUCache
+from mensable.models import Language, Table
+
+fragment_cache = LRUCache()
+
+
+def init_app(app):
+    fragment_cache.maxsize = app.config["FRAGMENT_CACHE_SIZE"]
+    fragment_cache.clear()
+
+
+def bump_table_version(table_id):
+    """Mark a table's page as changed. Does not commit."""
+    Table.query.filter_by(id=table_id).update({"version": Table.version + 1})
+
+
+def bump_language_version(language_id):
+    """Mark a language's listing of tables as changed. Does not commit."""
+    Language.query.filter_by(id=language_id).update(
+            {"version": Language.version + 1})
+
+
+def languages_version():
+    """Return a value that changes whenever any language is added or has its
+    version bumped, for keying the listings that span all languages."""
+    count, total = db.session.query(func.count(Language.id),
+            func.coalesce(func.sum(Language.version), 0)).one()
+    return f"{count}.{total}"
+
+
+def cached_fragment(key, render):
+    """Return the value cached under `key`, calling `render()` to create and
+    cache it if there is none."""
+    value = fragment_cache.get(key)
+    if value is None:
+        value = render()
+        fragment_cache.set(key, value)
+    return value
+
+
+def render_fragment(template, **context):
+    """Render a template for inclusion in a page with {{ fragment }}."""
+    return Markup(render_template(template, **context))
@@ -0,0 +1,109 @@
+"""Password hashing on a bounded pool of processes.
+
+Hashing a password is deliberately slow, so `password_hasher` runs it in a
+pool of PASSWORD_HASH_WORKERS processes rather than in the request's own
+worker. While one request waits for its hash, the worker's other threads
+(WEB_THREADS) keep serving pages. At most PASSWORD_HASH_QUEUE_LIMIT hashes
+may be running or waiting in each worker process, fewer than its threads;
+beyond that HashingBusy is raised so the request can be turned away at once
+instead of queueing behind a burst of logins. A limit of 0 or less means no
+limit. With PASSWORD_HASH_WORKERS set to 0, hashes are computed in the
+calling thread, e.g. in tests.
+
+New hashes use PASSWORD_HASH_METHOD, in werkzeug's format such as "scrypt" or
+"pbkdf2:sha256:600000". Hashes made with any other method are still checked
+correctly, and `needs_rehash` tells login to replace them."""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS,
+        check_password_hash, generate_password_hash)
+
+logger = logging.getLogger(__name__)
+
+# The parameters werkzeug uses for each method when none are given.
+METHOD_DEFAULTS = {"scrypt": ["32768", "8", "1"],
+        "pbkdf2": ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]}
+
+
+class HashingBusy(Exception):
+    """Raised when too many passwords are already waiting to be hashed."""
+
+
+def full_method(method):
+    """Return a hash method with werkzeug's defaults filled in, as it is
+    recorded at the start of a hash, e.g. "scrypt" -> "scrypt:32768:8:1"."""
+    name, *parameters = method.split(":")
+    defaults = METHOD_DEFAULTS.get(name, [])
+    return ":".join([name] + parameters + defaults[len(parameters):])
+
+
+class PasswordHasher(object):
+    """Hashes and checks passwords for the app, see the module docstring."""
+
+    def __init__(self):
+        self.method = "scrypt"
+        self.workers = 0
+        self._slots = None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        queue_limit = app.config["PASSWORD_HASH_QUEUE_LIMIT"]
+        self._slots = (threading.BoundedSemaphore(queue_limit)
+                if queue_limit > 0 else None)
+        if queue_limit >= app.config["WEB_THREADS"]:
+            logger.warning("PASSWORD_HASH_QUEUE_LIMIT (%s) is not below "
+                    "WEB_THREADS (%s), so logins are never turned away.",
+                    queue_limit, app.config["WEB_THREADS"])
+        self.shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def hash(self, password):
+        """Return a new hash of the password."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        """Return True if the password matches the hash."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Return True if the hash was made with a method other than the
+        configured one."""
+        return password_hash.split("$", 1)[0] != full_method(self.method)
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if self._slots is None:
+            return self._executor().submit(function, *args).result()
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _executor(self):
+        # Pools are started on first use, so each gunicorn worker gets its
+        # own rather than sharing one forked from the master process.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.workers,
+                        mp_context=multiprocessing.get_context("spawn"))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,213 @@
+"""Background jobs for slow operations, such as importing a large CSV file.
+
+    GET /jobs/<job_id>
+        Shows a job's progress, or returns it as JSON with ?format=json.
+
+`enqueue` records a Job row and starts it on this worker's pool of
+JOB_WORKERS threads, so the request that asked for it can return at once.
+With JOB_WORKERS set to 0 jobs run in the calling thread instead, e.g. in
+tests. A job is claimed with a single UPDATE, so only one thread in one
+worker runs it at a time.
+
+Handlers, registered with `job_handler`, commit their work in steps and call
+`record_progress` before each commit, which also updates the job's
+heartbeat. A job that has waited in the queue, or gone without a heartbeat,
+for JOB_STALE_SECONDS has lost its worker. Each worker serving requests runs
+a sweeper thread that resumes such jobs every JOB_SWEEP_SECONDS, so they are
+picked up even when a replacement worker started before they went stale.
+Command-line processes such as `flask db-upgrade` never run jobs. Handlers
+carry on from the progress their last run committed."""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import (Blueprint, abort, current_app, jsonify, render_template,
+        request, session)
+from sqlalchemy import or_
+
+from mensable import db
+from mensable.auth import login_required
+from mensable.leitner import utcnow
+from mensable.models import Job
+
+bp = Blueprint("jobs", __name__)
+
+# Functions running each kind of job, by kind.
+HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register a function taking a Job as the handler for a kind of job."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+class JobRunner(object):
+    """Runs jobs for the app, see the module docstring."""
+
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self.sweep_seconds = 0
+        self._pool = None
+        self._pool_pid = None
+        self._sweeper_pid = None
+        # Jobs submitted to this process's pool and not yet finished.
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config["JOB_WORKERS"]
+        self.sweep_seconds = app.config["JOB_SWEEP_SECONDS"]
+        with self._lock:
+            self._pool = None
+            self._pending.clear()
+
+    def enqueue(self, kind, params, payload=None):
+        """Record a job for the current user and start it. Returns the
+        Job, which has finished already if JOB_WORKERS is 0."""
+        job = Job(kind, session.get("user_id"), params, payload)
+        db.session.add(job)
+        db.session.commit()
+        self.submit(job.id)
+        return job
+
+    def submit(self, job_id):
+        if not self.workers:
+            run_job(job_id)
+            return
+        with self._lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._executor().submit(self._run_in_app, job_id)
+
+    def resume(self):
+        """Start every job that has lost its worker."""
+        for job_id in stale_job_ids():
+            self.submit(job_id)
+
+    def start(self):
+        """Start this worker's sweeper thread, unless it is running already
+        or jobs run inline. Called before each request, so that only
+        processes serving requests run jobs."""
+        if not self.workers or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep, name="job-sweeper",
+                daemon=True).start()
+
+    def _sweep(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.resume()
+                except Exception:
+                    self.app.logger.exception("Stale jobs could not be resumed")
+            time.sleep(self.sweep_seconds)
+
+    def _run_in_app(self, job_id):
+        with self.app.app_context():
+            try:
+                run_job(job_id)
+            except Exception:
+                self.app.logger.exception("Job %s could not be run", job_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(job_id)
+
+    def _executor(self):
+        # Like the password hashing pool, started on first use in each
+        # worker process.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.workers,
+                        thread_name_prefix="job")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+job_runner = JobRunner()
+
+
+def stale_before():
+    return utcnow() - timedelta(seconds=current_app.config["JOB_STALE_SECONDS"])
+
+
+def stale_job_ids():
+    """Return the ids of jobs that have been queued, or running without a
+    heartbeat, for JOB_STALE_SECONDS, oldest first."""
+    before = stale_before()
+    return [job_id for (job_id,) in db.session.query(Job.id)
+            .filter(or_((Job.state == "queued") & (Job.created_at < before),
+                (Job.state == "running") & (Job.heartbeat_at < before)))
+            .order_by(Job.id)]
+
+
+def claim(job_id):
+    """Mark a job as running by this thread if no other is running it, with
+    a single UPDATE. Returns True if it was claimed."""
+    claimed = Job.query.filter(Job.id == job_id,
+            or_(Job.state == "queued", (Job.state == "running")
+                & (Job.heartbeat_at < stale_before()))) \
+            .update({"state": "running", "heartbeat_at": utcnow()},
+                synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def run_job(job_id):
+    """Run a job to completion, unless it is finished or running elsewhere."""
+    if not claim(job_id):
+        return
+    job = Job.query.filter_by(id=job_id).first()
+    try:
+        HANDLERS[job.kind](job)
+    except Exception as error:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s) failed", job.id, job.kind)
+        job = Job.query.filter_by(id=job_id).first()
+        job.state = "failed"
+        job.error = str(error) or type(error).__name__
+    else:
+        job.state = "done"
+    job.finished_at = utcnow()
+    db.session.commit()
+
+
+def record_progress(job, progress, total=None, result=None):
+    """Update a job's progress and heartbeat, to be committed along with the
+    work they describe."""
+    job.progress = progress
+    if total is not None:
+        job.total = total
+    if result is not None:
+        job.result = dict(result)
+    job.heartbeat_at = utcnow()
+
+
+@bp.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id):
+    """Show the progress of one of the user's jobs."""
+    job = Job.query.filter_by(id=job_id, user_id=session["user_id"]).first()
+    if not job:
+        abort(404)
+    if request.args.get("format") == "json":
+        return jsonify(id=job.id, kind=job.kind, state=job.state,
+                progress=job.progress, total=job.total, result=job.result,
+                error=job.error)
+    return render_template("job.html", job=job)
+
+
+def init_app(app):
+    job_runner.init_app(app)
+    app.before_request(job_runner.start)
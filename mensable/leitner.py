@@ -0,0 +1,158 @@
+"""Leitner box bookkeeping and review scheduling for subscriptions.
+
+Each LeitnerBox row records the box of one word pair for one subscription,
+and when it is next due, so quizzes read and update only the word pairs they
+involve rather than loading and rewriting a whole dictionary. A word pair
+answered correctly moves to the next box and is due again after that box's
+interval in BOX_INTERVALS; one answered wrongly goes back to box 0 and is due
+at once.
+
+Every word pair in a subscribed table has a row from the moment it is added
+or subscribed to, which lets quizzes pick their questions from the front of
+the (subscription_id, due_at, shuffle_key) index without looking at the rest
+of the table, and lets the home page count the due word pairs of all a user's
+subscriptions in one query."""
+import random
+from datetime import timedelta
+
+from sqlalchemy import DateTime, and_, exists, func, literal, select
+
+from mensable import db
+from mensable.fragments import bump_language_version, bump_table_version
+from mensable.models import (LeitnerBox, Subscription, Table, table_word_pair,
+        utcnow)
+
+# How long after being moved into each box a word pair is due again. Boxes
+# beyond the last use its interval.
+BOX_INTERVALS = [timedelta(0), timedelta(days=1), timedelta(days=3),
+        timedelta(days=7), timedelta(days=14), timedelta(days=30),
+        timedelta(days=60)]
+
+
+def due_date(box, now):
+    """Return when a word pair moved into `box` at `now` is next due."""
+    return now + BOX_INTERVALS[min(box, len(BOX_INTERVALS) - 1)]
+
+
+def insert_missing_boxes(*criteria):
+    """Put word pairs that are in a subscribed table but have no Leitner box
+    yet into box 0, using a single INSERT ... SELECT. `criteria` restrict the
+    subscriptions and word pairs considered."""
+    missing = (select(Subscription.id.label("subscription_id"),
+                table_word_pair.c.word_pair_id, Subscription.learner_id)
+            .join(table_word_pair,
+                table_word_pair.c.table_id == Subscription.table_id)
+            .where(*criteria)
+            .where(~exists().where(and_(
+                LeitnerBox.subscription_id == Subscription.id,
+                LeitnerBox.word_pair_id == table_word_pair.c.word_pair_id)))
+            .distinct()
+            .subquery())
+    # Selecting from the subquery keeps the DISTINCT separate from the
+    # per-row column defaults that the INSERT adds. due_at's default is
+    # computed in Python, which INSERT ... SELECT cannot do, so it is given.
+    db.session.execute(LeitnerBox.__table__.insert().from_select(
+            ["subscription_id", "word_pair_id", "learner_id", "due_at"],
+            select(missing.c.subscription_id, missing.c.word_pair_id,
+                missing.c.learner_id, literal(utcnow(), DateTime))))
+
+
+def subscribe(user, table):
+    """Create a subscription with every word pair in the table in box 0.
+    Does not commit."""
+    sub = Subscription(user, table)
+    db.session.add(sub)
+    db.session.flush()
+    insert_missing_boxes(Subscription.id == sub.id)
+    # The table's subscriber count has changed.
+    bump_table_version(table.id)
+    bump_language_version(table.language_id)
+    return sub
+
+
+def add_words_to_subscriptions(table, word_pair_ids):
+    """Give word pairs just added to a table a box for each of its
+    subscribers. Does not commit."""
+    insert_missing_boxes(Subscription.table_id == table.id,
+            table_word_pair.c.word_pair_id.in_(word_pair_ids))
+
+
+def due_word_ids(sub, count):
+    """Return the ids of up to `count` word pairs, those due longest ago
+    first, in random order among those due at the same time. If fewer than
+    `count` are due, those due soonest make up the rest."""
+    query = (db.session.query(LeitnerBox.word_pair_id)
+            .filter_by(subscription_id=sub.id)
+            .order_by(LeitnerBox.due_at, LeitnerBox.shuffle_key)
+            .limit(count))
+    return [word_pair_id for (word_pair_id,) in query]
+
+
+def due_count_column(now):
+    """Return a column expression counting a Subscription's word pairs that
+    are due at `now`, for adding to a query of subscriptions."""
+    return (select(func.count())
+            .where(LeitnerBox.subscription_id == Subscription.id,
+                LeitnerBox.due_at <= now)
+            .correlate(Subscription)
+            .scalar_subquery())
+
+
+def review_word_ids(user_id, count, language_id=None):
+    """Return (subscription_id, word_pair_id) pairs for up to `count` word
+    pairs from all of a user's subscriptions, or those to tables in one
+    language, in the order of `due_word_ids`. A word pair in several of the
+    tables is only returned once."""
+    query = (db.session.query(LeitnerBox.subscription_id,
+                LeitnerBox.word_pair_id)
+            .filter(LeitnerBox.learner_id == user_id)
+            .order_by(LeitnerBox.due_at, LeitnerBox.shuffle_key))
+    if language_id is not None:
+        query = (query.join(Subscription,
+                    Subscription.id == LeitnerBox.subscription_id)
+                .join(Table, Table.id == Subscription.table_id)
+                .filter(Table.language_id == language_id))
+
+    # Fetch a few spare rows in case of repeated word pairs.
+    pairs, seen = [], set()
+    for sub_id, word_id in query.limit(count * 2):
+        if word_id not in seen and len(pairs) < count:
+            seen.add(word_id)
+            pairs.append((sub_id, word_id))
+    return pairs
+
+
+def update_boxes(sub, right_ids, wrong_ids):
+    """Move correctly answered word pairs along to the next box and send
+    incorrectly answered ones back to box 0, scheduling each for its new
+    box's interval from now. Does not commit."""
+    update_review_boxes([(sub.id, word_id) for word_id in right_ids],
+            [(sub.id, word_id) for word_id in wrong_ids])
+
+
+def update_review_boxes(right, wrong):
+    """Like `update_boxes`, for (subscription_id, word_pair_id) pairs that
+    may belong to several subscriptions, reading all their boxes in a single
+    query. Does not commit."""
+    keys = set(right) | set(wrong)
+    boxes = {(box.subscription_id, box.word_pair_id): box
+            for box in LeitnerBox.query.filter(
+                LeitnerBox.subscription_id.in_(set(sub_id
+                    for sub_id, _ in keys)),
+                LeitnerBox.word_pair_id.in_(set(word_id
+                    for _, word_id in keys)))
+            if (box.subscription_id, box.word_pair_id) in keys}
+
+    # Word pairs deleted since the quiz started no longer have a box.
+    for key in right:
+        if key in boxes:
+            boxes[key].box += 1
+    for key in wrong:
+        if key in boxes:
+            boxes[key].box = 0
+    now = utcnow()
+    for box in boxes.values():
+        box.due_at = due_date(box.box, now)
+        # Drawn here rather than with the database's random() so that the flush
+        # can batch the boxes' UPDATEs rather than send one each.
+        box.shuffle_key = random.random()
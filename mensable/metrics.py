@@ -0,0 +1,273 @@
+"""Request metrics, served in the Prometheus text format at /metrics.
+
+For every request the wall time, the number of SQL statements run and the
+time spent in them are recorded against the request's endpoint (e.g.
+"api.quiz"), using Flask request hooks and SQLAlchemy engine events.
+
+Each gunicorn worker keeps its own counts. When METRICS_DIR is set, workers
+write their counts to a file in that directory at most every
+METRICS_DUMP_INTERVAL seconds, and /metrics adds up the files of all workers,
+so whichever worker answers a scrape reports the totals. Without METRICS_DIR
+only the answering worker's counts are reported.
+
+When a worker exits, gunicorn's child_exit hook calls `retire_worker`, which
+adds its counters to the directory's RETIRED_FILE and removes its own file.
+The totals therefore keep counting after a worker restarts, even one that
+reuses a pid, while its cache size gauge is dropped."""
+import json
+import os
+import threading
+import time
+
+from flask import (Blueprint, Response, current_app, g, has_request_context,
+        request)
+from sqlalchemy import event
+
+from mensable import db
+from mensable.words import word_pair_cache
+
+bp = Blueprint("metrics", __name__)
+
+# Upper bounds of the histogram buckets for each measurement.
+HISTOGRAMS = {
+    "request_duration_seconds": ("Wall time spent handling requests.",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    "sql_statements": ("SQL statements run per request.",
+        (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)),
+    "sql_duration_seconds": ("Time spent in SQL statements per request.",
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)),
+}
+
+
+class Metrics(object):
+    """The counts of one worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_dump = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # {endpoint: {method: {status: count}}}
+            self.requests = {}
+            # {histogram: {endpoint: {"buckets": [...], "sum": x, "count": n}}}
+            self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def observe(self, endpoint, method, status, values):
+        """Record one request. `values` maps each histogram's name to the
+        request's measurement."""
+        with self._lock:
+            statuses = self.requests.setdefault(endpoint, {}).setdefault(
+                    method, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            for name, value in values.items():
+                bounds = HISTOGRAMS[name][1]
+                histogram = self.histograms[name].setdefault(endpoint,
+                        {"buckets": [0] * (len(bounds) + 1), "sum": 0,
+                         "count": 0})
+                index = next((i for i, bound in enumerate(bounds)
+                    if value <= bound), len(bounds))
+                histogram["buckets"][index] += 1
+                histogram["sum"] += value
+                histogram["count"] += 1
+
+    def snapshot(self):
+        """Return this process's counts as JSON-serializable data."""
+        with self._lock:
+            return json.loads(json.dumps({"requests": self.requests,
+                "histograms": self.histograms,
+                "word_pair_cache": word_pair_cache.info()}))
+
+    def dump(self, directory, interval=0):
+        """Write this process's counts to `directory`, unless they were
+        written less than `interval` seconds ago."""
+        now = time.monotonic()
+        if now - self._last_dump < interval:
+            return
+        self._last_dump = now
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as output:
+            json.dump(self.snapshot(), output)
+        # Readers never see a half-written file.
+        os.replace(path + ".tmp", path)
+
+
+# Counts of workers that have exited, summed.
+RETIRED_FILE = "metrics-retired.json"
+
+
+def retire_worker(directory, pid):
+    """Add the counters last written by an exited worker to RETIRED_FILE and
+    remove the worker's file. Only the gunicorn master calls this, so the
+    retired totals are never written by two processes at once."""
+    path = os.path.join(directory, f"metrics-{pid}.json")
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    try:
+        with open(path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return
+    snapshot["word_pair_cache"]["size"] = 0
+    snapshots = [snapshot]
+    try:
+        with open(retired_path) as retired_file:
+            snapshots.append(json.load(retired_file))
+    except (OSError, ValueError):
+        pass
+    with open(retired_path + ".tmp", "w") as output:
+        json.dump(merge(snapshots), output)
+    os.replace(retired_path + ".tmp", retired_path)
+    os.remove(path)
+
+
+def collect(metrics, directory):
+    """Return the counts of every worker that has written to `directory`,
+    plus this process's current counts."""
+    snapshots = [metrics.snapshot()]
+    if directory:
+        own_file = f"metrics-{os.getpid()}.json"
+        for name in sorted(os.listdir(directory)):
+            if name == own_file or not (name.startswith("metrics-")
+                    and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue
+    return merge(snapshots)
+
+
+def merge(snapshots):
+    """Add up the counts in several snapshots."""
+    total = {"requests": {}, "histograms": {name: {} for name in HISTOGRAMS},
+             "word_pair_cache": {"hits": 0, "misses": 0, "size": 0}}
+    for snapshot in snapshots:
+        for endpoint, methods in snapshot["requests"].items():
+            for method, statuses in methods.items():
+                into = total["requests"].setdefault(endpoint, {}).setdefault(
+                        method, {})
+                for status, count in statuses.items():
+                    into[status] = into.get(status, 0) + count
+        for name, endpoints in snapshot["histograms"].items():
+            if name not in HISTOGRAMS:
+                continue
+            for endpoint, histogram in endpoints.items():
+                into = total["histograms"][name].setdefault(endpoint,
+                        {"buckets": [0] * len(histogram["buckets"]), "sum": 0,
+                         "count": 0})
+                into["buckets"] = [a + b for a, b in
+                        zip(into["buckets"], histogram["buckets"])]
+                into["sum"] += histogram["sum"]
+                into["count"] += histogram["count"]
+        for key in total["word_pair_cache"]:
+            total["word_pair_cache"][key] += snapshot["word_pair_cache"].get(
+                    key, 0)
+    return total
+
+
+def render(totals):
+    """Format merged counts in the Prometheus text exposition format."""
+    lines = ["# HELP mensable_requests_total Requests handled.",
+             "# TYPE mensable_requests_total counter"]
+    for endpoint, methods in sorted(totals["requests"].items()):
+        for method, statuses in sorted(methods.items()):
+            for status, count in sorted(statuses.items()):
+                lines.append(f'mensable_requests_total{{endpoint="{endpoint}",'
+                             f'method="{method}",status="{status}"}} {count}')
+
+    for name, (description, bounds) in HISTOGRAMS.items():
+        metric = f"mensable_{name}"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} histogram")
+        for endpoint, histogram in sorted(totals["histograms"][name].items()):
+            cumulative = 0
+            for bound, count in zip(list(bounds) + ["+Inf"],
+                    histogram["buckets"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{endpoint="{endpoint}",'
+                             f'le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{endpoint="{endpoint}"}} '
+                         f'{histogram["sum"]}')
+            lines.append(f'{metric}_count{{endpoint="{endpoint}"}} '
+                         f'{histogram["count"]}')
+
+    cache = totals["word_pair_cache"]
+    lines += ["# HELP mensable_word_pair_cache_hits_total Word pair cache hits.",
+              "# TYPE mensable_word_pair_cache_hits_total counter",
+              f"mensable_word_pair_cache_hits_total {cache['hits']}",
+              "# HELP mensable_word_pair_cache_misses_total Word pair cache "
+              "misses.",
+              "# TYPE mensable_word_pair_cache_misses_total counter",
+              f"mensable_word_pair_cache_misses_total {cache['misses']}",
+              "# HELP mensable_word_pair_cache_size Word pairs cached.",
+              "# TYPE mensable_word_pair_cache_size gauge",
+              f"mensable_word_pair_cache_size {cache['size']}"]
+    return "\n".join(lines) + "\n"
+
+
+@bp.route("/metrics")
+def metrics():
+    totals = collect(current_app.extensions["mensable_metrics"],
+            current_app.config["METRICS_DIR"])
+    return Response(render(totals),
+            mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None or not has_request_context() or "metrics_sql" not in g:
+        return
+    g.metrics_sql[0] += 1
+    g.metrics_sql[1] += time.perf_counter() - start
+
+
+def start_timer():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql = [0, 0.0]
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def record_request(exception):
+    if "metrics_start" not in g:
+        return
+    app = current_app._get_current_object()
+    metrics = app.extensions["mensable_metrics"]
+    statements, sql_seconds = g.metrics_sql
+    metrics.observe(request.endpoint or "unmatched", request.method,
+            str(g.get("metrics_status", 500)),
+            {"request_duration_seconds":
+                time.perf_counter() - g.metrics_start,
+             "sql_statements": statements,
+             "sql_duration_seconds": sql_seconds})
+    if app.config["METRICS_DIR"]:
+        metrics.dump(app.config["METRICS_DIR"],
+                app.config["METRICS_DUMP_INTERVAL"])
+
+
+def init_app(app):
+    """Start recording metrics for the app. Call after db.init_app."""
+    app.extensions["mensable_metrics"] = Metrics()
+    if app.config["METRICS_DIR"]:
+        os.makedirs(app.config["METRICS_DIR"], exist_ok=True)
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    app.before_request(start_timer)
+    app.after_request(record_status)
+    app.teardown_request(record_request)
+    app.register_blueprint(bp)
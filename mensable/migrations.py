@@ -0,0 +1,351 @@
+"""Upgrades for databases created by older versions of mensable.
+
+`db.create_all()` only creates missing tables, so changes to existing tables
+and their data are made here instead. Every step is idempotent, so running
+`flask db-upgrade` on an up-to-date database does nothing.
+
+`upgrade` records SCHEMA_VERSION in the database when it finishes, which lets
+`init_schema` skip all DDL when a worker starts against an up-to-date
+database."""
+import logging
+import pickle
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (LargeBinary, func, inspect, select, text,
+        type_coerce, update)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import AddConstraint
+
+from mensable import db
+from mensable.leitner import insert_missing_boxes
+from mensable.models import (LeitnerBox, SchemaVersion, Subscription,
+        table_word_pair)
+from mensable.quizzes import encode_results
+from mensable.search import index_missing_word_pairs
+
+logger = logging.getLogger(__name__)
+
+# Increase whenever models.py changes in a way that needs `flask db-upgrade`.
+SCHEMA_VERSION = 8
+
+# Number of rows converted between commits during data migrations.
+MIGRATION_BATCH_SIZE = 100
+
+# Indexes from earlier versions that newer indexes have replaced.
+OBSOLETE_INDEXES = ["ix_leitner_box_subscription_box",
+        "ix_table_word_pair_table_id", "ix_leitner_box_queue"]
+
+
+def add_missing_columns():
+    """Add columns declared in models.py that an existing table lacks, and
+    fill them in from the column's default. The columns are added as
+    nullable, since most databases cannot add a NOT NULL column to a table
+    that already has rows. Returns the number of columns added."""
+    connection = db.session.connection()
+    preparer = connection.dialect.identifier_preparer
+    inspector = inspect(connection)
+    added = 0
+
+    for table in db.metadata.sorted_tables:
+        existing = set(column["name"] for column in
+                inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} "
+                    f"{column.type.compile(dialect=connection.dialect)}"))
+            default = column.default
+            if default is not None:
+                value = default.arg(None) if default.is_callable else default.arg
+                connection.execute(table.update().values({column.name: value}))
+            added += 1
+
+    db.session.commit()
+    return added
+
+
+def remove_duplicate_subscriptions():
+    """Delete all but the first subscription of each user to each table, so
+    that the unique index on (learner_id, table_id) can be built. Returns the
+    number of subscriptions deleted."""
+    first_ids = (select(func.min(Subscription.id))
+            .group_by(Subscription.learner_id, Subscription.table_id))
+    duplicates = Subscription.query.filter(Subscription.id.not_in(first_ids)).all()
+    for sub in duplicates:
+        db.session.delete(sub)
+    db.session.commit()
+    return len(duplicates)
+
+
+def create_missing_indexes():
+    """Create indexes declared in models.py that do not exist yet, and drop
+    the ones they replace. Returns the number of indexes created."""
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    created = 0
+
+    for table in db.metadata.sorted_tables:
+        existing = set(index["name"] for index in
+                inspector.get_indexes(table.name))
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                connection.execute(text(f"DROP INDEX {name}"))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                created += 1
+
+    db.session.commit()
+    return created
+
+
+def foreign_key_rules(table, inspector):
+    """Return the foreign keys of `table` whose ON DELETE rule in the
+    database differs from models.py, as (declared constraint, existing
+    constraint name) pairs."""
+    existing = {(tuple(fk["constrained_columns"]), fk["referred_table"]): fk
+            for fk in inspector.get_foreign_keys(table.name)}
+    changed = []
+    for constraint in table.foreign_key_constraints:
+        key = (tuple(constraint.column_keys), constraint.referred_table.name)
+        fk = existing.get(key)
+        if fk is None:
+            continue
+        rule = (fk.get("options", {}).get("ondelete") or "").upper()
+        if rule != (constraint.ondelete or "").upper():
+            changed.append((constraint, fk["name"]))
+    return changed
+
+
+def rebuild_sqlite_table(connection, table):
+    """Recreate a table as models.py declares it, keeping its rows, since
+    SQLite cannot alter the constraints of an existing table. Must run with
+    foreign keys off and legacy_alter_table on."""
+    inspector = inspect(connection)
+    columns = [column.name for column in table.columns if column.name in
+            set(column["name"] for column in inspector.get_columns(table.name))]
+    # The old indexes keep their names when the table is renamed, so they go
+    # first to make way for the new table's.
+    for index in inspector.get_indexes(table.name):
+        connection.execute(text(f"DROP INDEX {index['name']}"))
+
+    preparer = connection.dialect.identifier_preparer
+    old_name = preparer.quote(f"old_{table.name}")
+    connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} "
+            f"RENAME TO {old_name}"))
+    # Created under its real name, so its indexes get their real names too.
+    table.create(connection)
+    column_list = ", ".join(preparer.quote(column) for column in columns)
+    connection.execute(text(
+            f"INSERT INTO {preparer.format_table(table)} ({column_list}) "
+            f"SELECT {column_list} FROM {old_name}"))
+    connection.execute(text(f"DROP TABLE {old_name}"))
+
+
+def update_foreign_keys():
+    """Give existing foreign keys the ON DELETE rules declared in models.py,
+    which let deletes of tables and word pairs cascade in the database.
+    Returns the number of tables changed."""
+    db.session.commit()
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    changed = [(table, rules) for table in db.metadata.sorted_tables
+            for rules in [foreign_key_rules(table, inspector)] if rules]
+    if not changed:
+        return 0
+
+    if connection.dialect.name == "sqlite":
+        # PRAGMA foreign_keys has no effect inside a transaction, so the
+        # session's transaction is ended first and a new one begun after.
+        db.session.rollback()
+        connection = db.session.connection()
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        # Otherwise renaming a table also repoints the foreign keys of other
+        # tables at its old copy.
+        connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        try:
+            for table, _ in changed:
+                rebuild_sqlite_table(connection, table)
+            db.session.commit()
+        finally:
+            connection = db.session.connection()
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+    else:
+        preparer = connection.dialect.identifier_preparer
+        for table, rules in changed:
+            for constraint, name in rules:
+                connection.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"DROP CONSTRAINT {preparer.quote(name)}"))
+                connection.execute(AddConstraint(constraint))
+        db.session.commit()
+    return len(changed)
+
+
+def migrate_leitner_boxes():
+    """Convert pickled Subscription.leitner_boxes dictionaries into LeitnerBox
+    rows, clearing each pickle once it has been converted. Returns the number
+    of subscriptions converted."""
+    sub_ids = [sub_id for (sub_id,) in db.session.query(Subscription.id)
+            .filter(Subscription.leitner_boxes.isnot(None))]
+
+    for count, sub_id in enumerate(sub_ids, 1):
+        sub = Subscription.query.filter_by(id=sub_id).first()
+        lboxes = sub.leitner_boxes or {}
+
+        # Skip words that have since left the table. The pickle is the
+        # learner's real progress, so it overrides any existing rows.
+        in_table = set(word_pair_id for (word_pair_id,) in
+                db.session.query(table_word_pair.c.word_pair_id)
+                .filter(table_word_pair.c.table_id == sub.table_id))
+        existing = {box.word_pair_id: box for box in
+                LeitnerBox.query.filter_by(subscription_id=sub.id)}
+        for word_pair_id, box in lboxes.items():
+            if word_pair_id in existing:
+                existing[word_pair_id].box = box
+            elif word_pair_id in in_table:
+                db.session.add(LeitnerBox(sub.id, word_pair_id,
+                        sub.learner_id, box))
+
+        sub.leitner_boxes = None
+        if count % MIGRATION_BATCH_SIZE == 0:
+            db.session.commit()
+
+    db.session.commit()
+    return len(sub_ids)
+
+
+def legacy_results_record(data):
+    """Return the last_quiz_record and last_percentage_score columns for a
+    pickled results dictionary, or None for both if it is empty or no longer
+    loads."""
+    try:
+        results = pickle.loads(data)
+        if results:
+            return {"last_quiz_record": encode_results(results),
+                    "last_percentage_score": results["percentage_score"]}
+    except Exception:
+        # Pickles of WordPair objects break whenever the model changes.
+        logger.warning("Dropping last quiz results that could not be read.",
+                exc_info=True)
+    return {"last_quiz_record": None, "last_percentage_score": None}
+
+
+def migrate_last_quiz_results():
+    """Rewrite the pickled Subscription.last_quiz_results, which hold whole
+    WordPair objects, as last_quiz_record and last_percentage_score, clearing
+    each pickle once it has been converted. Returns the number of
+    subscriptions converted."""
+    # Read as bytes, so that a pickle that does not load can be dropped
+    # rather than failing the query.
+    pickled = type_coerce(Subscription.last_quiz_results, LargeBinary)
+    converted, after = 0, 0
+    while True:
+        rows = db.session.execute(select(Subscription.id, pickled)
+                .where(Subscription.id > after,
+                    Subscription.last_quiz_results.isnot(None))
+                .order_by(Subscription.id)
+                .limit(MIGRATION_BATCH_SIZE)).all()
+        if not rows:
+            return converted
+        db.session.execute(update(Subscription), [dict(id=sub_id,
+                last_quiz_results=None, **legacy_results_record(data))
+            for sub_id, data in rows])
+        db.session.commit()
+        converted += len(rows)
+        after = rows[-1][0]
+
+
+def backfill_leitner_boxes():
+    """Give every word pair in every subscribed table a Leitner box, which
+    quiz selection has relied on since boxes stopped being created lazily.
+    Returns the number of boxes created."""
+    before = LeitnerBox.query.count()
+    insert_missing_boxes()
+    db.session.commit()
+    return LeitnerBox.query.count() - before
+
+
+def backfill_box_learners():
+    """Copy each Leitner box's learner from its subscription, for boxes made
+    before LeitnerBox.learner_id existed, in a single UPDATE. Returns the
+    number of boxes updated."""
+    learner = (select(Subscription.learner_id)
+            .where(Subscription.id == LeitnerBox.subscription_id)
+            .scalar_subquery())
+    updated = LeitnerBox.query.filter(LeitnerBox.learner_id.is_(None)) \
+            .update({"learner_id": learner}, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
+def get_schema_version():
+    """Return the schema version recorded in the database, or None if there
+    is none, with a single query."""
+    try:
+        return db.session.execute(select(func.max(SchemaVersion.version))) \
+                .scalar()
+    except DBAPIError:
+        # The schema_version table does not exist yet.
+        db.session.rollback()
+        return None
+
+
+def set_schema_version(version):
+    SchemaVersion.query.delete()
+    db.session.add(SchemaVersion(version))
+    db.session.commit()
+
+
+def init_schema():
+    """Prepare the database when the app starts, and return what was done.
+
+    If the database is up to date, nothing is done beyond reading its schema
+    version. An empty database has every table created. Otherwise any
+    missing tables are created, but changes to existing tables are left to
+    `flask db-upgrade`."""
+    version = get_schema_version()
+    if version is not None and version >= SCHEMA_VERSION:
+        return "current"
+
+    empty = version is None and not inspect(db.engine).get_table_names()
+    db.create_all()
+    if empty:
+        set_schema_version(SCHEMA_VERSION)
+        return "created"
+    logger.warning("Database schema version %s is older than %s; run "
+            "`flask db-upgrade`.", version, SCHEMA_VERSION)
+    return "outdated"
+
+
+def upgrade():
+    """Bring the database schema and data up to date."""
+    db.create_all()
+    steps = {"columns": add_missing_columns(),
+             "duplicate_subscriptions": remove_duplicate_subscriptions(),
+             "indexes": create_missing_indexes(),
+             "leitner_boxes": migrate_leitner_boxes(),
+             "last_quiz_results": migrate_last_quiz_results(),
+             "backfilled_leitner_boxes": backfill_leitner_boxes(),
+             "box_learners": backfill_box_learners(),
+             # After the backfills, as rebuilt tables have NOT NULL columns.
+             "foreign_keys": update_foreign_keys(),
+             "indexed_word_pairs": index_missing_word_pairs()}
+    set_schema_version(SCHEMA_VERSION)
+    return steps
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def upgrade_command():
+    """Upgrade the database to the current schema."""
+    for step, count in upgrade().items():
+        click.echo(f"{step}: {count}")
+
+
+def init_app(app):
+    app.cli.add_command(upgrade_command)
@@ -1,8 +1,17 @@
-from datetime import date
+from datetime import date, datetime, timezone
+
+from sqlalchemy import func, select
 
 from mensable import db
 
 
+def utcnow():
+    """Return the current UTC time as a naive datetime, as the DateTime
+    columns below store it. Used as their default rather than the database's
+    CURRENT_TIMESTAMP, which is local time on some servers."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class User(db.Model):
     """Basic information about user accounts"""
     id = db.Column("id", db.Integer, primary_key=True)
@@ -31,6 +40,9 @@ class Language(db.Model):
     name = db.Column(db.String(100), unique=True)
     tables = db.relationship('Table', backref='language', lazy=True)
     words = db.relationship('WordPair', backref='language', lazy=True)
+    # Increased whenever the listing of the language's tables changes (see
+    # fragments.py).
+    version = db.Column(db.Integer, default=1, nullable=False)
 
     def __init__(self, name):
         self.name = name
@@ -48,9 +60,22 @@ class Subscription(db.Model):
     their knowledge is via the Leitner system."""
     id = db.Column("id", db.Integer, primary_key=True)
     learner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    table_id = db.Column(db.Integer, db.ForeignKey('table.id'))
+    table_id = db.Column(db.Integer,
+            db.ForeignKey('table.id', ondelete='CASCADE'), index=True)
+    # Boxes are deleted with their subscription by the database.
+    boxes = db.relationship('LeitnerBox', backref='subscription',
+            cascade="all, delete-orphan", passive_deletes=True)
+    # Legacy pickled {word_pair_id: box} dictionary, superseded by LeitnerBox
+    # rows. Only read by migrations.migrate_leitner_boxes.
     leitner_boxes = db.Column(db.PickleType)
-    last_quiz_results = db.Column(db.PickleType)
+    # Legacy pickled results of the last quiz, superseded by
+    # last_quiz_record. Deferred so that loading a subscription never
+    # unpickles it; only read by migrations.migrate_last_quiz_results.
+    last_quiz_results = db.deferred(db.Column(db.PickleType))
+    # The ids of the words answered right and wrong in the last quiz, see
+    # quizzes.encode_results.
+    last_quiz_record = db.Column(db.JSON)
+    last_percentage_score = db.Column(db.Integer)
     quiz_attempts = db.Column(db.Integer)
     total_questions = db.Column(db.Integer)
     total_right = db.Column(db.Integer)
@@ -61,18 +86,67 @@ class Subscription(db.Model):
     def __init__(self, learner, table):
         self.learner_id = learner.id
         self.table_id = table.id
-        self.leitner_boxes = {}
-        self.last_quiz_results = {}
         self.quiz_attempts = 0
         self.total_questions = 0
         self.total_right = 0
         self.last_quiz_date = date.today()
 
+    # A user has at most one subscription to each table.
+    __table_args__ = (db.Index('ix_subscription_learner_table',
+            'learner_id', 'table_id', unique=True),)
+
+
+class LeitnerBox(db.Model):
+    """The Leitner box that one WordPair is currently in for one Subscription,
+    and when it is next due to be reviewed. Box 0 holds new and recently
+    missed words."""
+    subscription_id = db.Column(db.Integer,
+            db.ForeignKey('subscription.id', ondelete='CASCADE'),
+            primary_key=True)
+    word_pair_id = db.Column(db.Integer,
+            db.ForeignKey('word_pair.id', ondelete='CASCADE'),
+            primary_key=True)
+    # The subscription's learner, copied here so that review quizzes can
+    # read the most overdue word pairs of all their subscriptions from one
+    # index.
+    learner_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+            nullable=False)
+    box = db.Column(db.Integer, default=0, nullable=False)
+    # UTC time from which the word pair is due; new word pairs are due at
+    # once. Set from the box's interval whenever the box changes (see
+    # leitner.py).
+    due_at = db.Column(db.DateTime, default=utcnow,
+            nullable=False)
+    # Random tie-breaker between word pairs due at the same time, re-drawn
+    # every time the box changes.
+    shuffle_key = db.Column(db.Float, default=db.func.random(), nullable=False)
+
+    # Quizzes read the first few entries of this index for one subscription:
+    # the longest overdue first, in random order among those due together.
+    # The home page counts each subscription's due entries from it. Review
+    # quizzes read the second index in the same way across subscriptions.
+    # The third finds the boxes to delete along with a word pair.
+    __table_args__ = (db.Index('ix_leitner_box_due',
+            'subscription_id', 'due_at', 'shuffle_key'),
+        db.Index('ix_leitner_box_learner_due',
+            'learner_id', 'due_at', 'shuffle_key'),
+        db.Index('ix_leitner_box_word_pair_id', 'word_pair_id'))
+
+    def __init__(self, subscription_id, word_pair_id, learner_id, box=0):
+        self.subscription_id = subscription_id
+        self.word_pair_id = word_pair_id
+        self.learner_id = learner_id
+        self.box = box
+
 
 # Helper table for keeping track of which WordPairs are in which Tables
 table_word_pair = db.Table('table_word_pair',
-        db.Column('word_pair_id', db.Integer, db.ForeignKey('word_pair.id')),
-        db.Column('table_id', db.Integer, db.ForeignKey('table.id')))
+        db.Column('word_pair_id', db.Integer,
+            db.ForeignKey('word_pair.id', ondelete='CASCADE'), index=True),
+        db.Column('table_id', db.Integer,
+            db.ForeignKey('table.id', ondelete='CASCADE')),
+        # Lists a table's words in id order, a page at a time.
+        db.Index('ix_table_word_pair_table_word', 'table_id', 'word_pair_id'))
         
 
 class Table(db.Model):
@@ -80,12 +154,19 @@ class Table(db.Model):
     word-translation pairs to learn."""
     id = db.Column("id", db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True)
+    # Deleting a table deletes its subscriptions, their Leitner boxes and its
+    # links to word pairs in the database (ON DELETE CASCADE), so the ORM
+    # need not load them.
     words = db.relationship('WordPair', secondary=table_word_pair,
-            backref='contained_in')
-    subscriptions = db.relationship('Subscription', backref='table')
+            backref='contained_in', passive_deletes=True)
+    subscriptions = db.relationship('Subscription', backref='table',
+            passive_deletes=True)
     created = db.Column(db.String(20), default=date.today)
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     language_id = db.Column(db.Integer, db.ForeignKey('language.id'))
+    # Increased whenever the table's words or subscriber count change (see
+    # fragments.py).
+    version = db.Column(db.Integer, default=1, nullable=False)
 
     def __init__(self, name):
         self.name = name
@@ -106,8 +187,127 @@ class WordPair(db.Model):
     translation = db.Column(db.String(100))
     language_id = db.Column(db.Integer, db.ForeignKey('language.id'))
 
+    # Word pairs are looked up by their foreign word within a language.
+    __table_args__ = (db.Index('ix_word_pair_language_foreign_word',
+            'language_id', 'foreignWord'),)
+
     def __init__(self, foreignWord, translation):
         self.foreignWord = foreignWord
         self.translation = translation
 
 
+class WordTrigram(db.Model):
+    """One entry of the n-gram index used by search.py: a word pair whose
+    foreign word or translation contains the trigram."""
+    trigram = db.Column(db.String(3), primary_key=True)
+    word_pair_id = db.Column(db.Integer,
+            db.ForeignKey('word_pair.id', ondelete='CASCADE'),
+            primary_key=True, index=True)
+
+    def __init__(self, trigram, word_pair_id):
+        self.trigram = trigram
+        self.word_pair_id = word_pair_id
+
+
+class QuizAttempt(db.Model):
+    """One finished quiz. Rows are only ever added, so together they are a
+    user's full quiz history (see progress.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Null once the table has been deleted; the attempt still counts towards
+    # the user's daily totals.
+    table_id = db.Column(db.Integer,
+            db.ForeignKey('table.id', ondelete='SET NULL'))
+    taken_at = db.Column(db.DateTime, default=utcnow,
+            nullable=False)
+    total_count = db.Column(db.Integer, nullable=False)
+    right_count = db.Column(db.Integer, nullable=False)
+
+    # Progress rollups read a range of one user's attempts, by date and then
+    # by table.
+    __table_args__ = (db.Index('ix_quiz_attempt_user_taken',
+            'user_id', 'taken_at'),
+        db.Index('ix_quiz_attempt_user_table_taken',
+            'user_id', 'table_id', 'taken_at'),
+        db.Index('ix_quiz_attempt_table_id', 'table_id'))
+
+    def __init__(self, user_id, table_id, total_count, right_count):
+        self.user_id = user_id
+        self.table_id = table_id
+        self.total_count = total_count
+        self.right_count = right_count
+
+
+class SchemaVersion(db.Model):
+    """A single row recording the schema version that migrations.upgrade
+    last brought the database up to."""
+    version = db.Column(db.Integer, primary_key=True)
+
+    def __init__(self, version):
+        self.version = version
+
+
+class QuizState(db.Model):
+    """Server-side state of a quiz in progress, stored as JSON by the "sql"
+    backend in quiz_state.py. The user's session cookie holds only the random
+    id."""
+    id = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.Text)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    def __init__(self, id, data, expires_at):
+        self.id = id
+        self.data = data
+        self.expires_at = expires_at
+
+
+class Job(db.Model):
+    """A slow operation run in the background by jobs.py, and how far it has
+    got, so that it can be resumed if the worker running it stops."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # "queued", "running", "done" or "failed".
+    state = db.Column(db.String(20), default="queued", nullable=False)
+    params = db.Column(db.JSON, nullable=False)
+    # Input too large for params, e.g. the text of an uploaded CSV file.
+    payload = db.Column(db.Text)
+    # Units of work done so far, out of `total` if that is known.
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=utcnow,
+            nullable=False)
+    # Updated whenever a running job commits progress; a running job whose
+    # heartbeat has stopped is resumed by another worker's sweeper.
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_job_state_heartbeat',
+            'state', 'heartbeat_at'),)
+
+    def __init__(self, kind, user_id, params, payload=None):
+        self.kind = kind
+        self.user_id = user_id
+        self.params = params
+        self.payload = payload
+
+
+# Counts for listing pages, computed by the database in the same query as the
+# rows themselves. Deferred, so only queries that undefer them pay for them.
+Table.subscription_count = db.column_property(
+        select(func.count(Subscription.id))
+        .where(Subscription.table_id == Table.id)
+        .correlate_except(Subscription)
+        .scalar_subquery(),
+        deferred=True)
+
+Language.table_count = db.column_property(
+        select(func.count(Table.id))
+        .where(Table.language_id == Language.id)
+        .correlate_except(Table)
+        .scalar_subquery(),
+        deferred=True)
+
+
@@ -0,0 +1,83 @@
+"""A user's quiz history, summed up in SQL.
+
+Every finished quiz adds a QuizAttempt row. The rollups here group a range of
+one user's attempts by day or by table in the database, read from the
+(user_id, taken_at) and (user_id, table_id, taken_at) indexes, so the
+/progress page costs the same handful of queries however many quizzes the
+user has taken."""
+from datetime import timedelta
+
+from flask import Blueprint, render_template, session
+from sqlalchemy import Date, case, func, select
+
+from mensable import db
+from mensable.auth import login_required
+from mensable.leitner import utcnow
+from mensable.models import Language, QuizAttempt, Table, User
+
+bp = Blueprint("progress", __name__)
+
+# How far back the /progress page looks.
+PROGRESS_PERIOD = timedelta(days=366)
+
+
+def totals():
+    """Return the columns summing up a group of attempts: the number of
+    quizzes, questions and right answers, and the percentage right."""
+    questions = func.sum(QuizAttempt.total_count)
+    right = func.sum(QuizAttempt.right_count)
+    # Integer division is FLOOR() on SQLite, which fails on NULL, so it is
+    # only reached when there are questions; otherwise accuracy is NULL.
+    return (func.count().label("quizzes"), questions.label("questions"),
+            right.label("right"),
+            case((questions > 0, right * 100 // questions)).label("accuracy"))
+
+
+def daily_progress(user_id, since):
+    """Return one row per day since `since` on which the user finished a
+    quiz, most recent first, with the day's totals."""
+    day = func.date(QuizAttempt.taken_at, type_=Date).label("day")
+    return db.session.execute(select(day, *totals())
+            .where(QuizAttempt.user_id == user_id,
+                QuizAttempt.taken_at >= since)
+            .group_by(day)
+            .order_by(day.desc())).all()
+
+
+def table_progress(user_id, since):
+    """Return one row per table the user has finished a quiz on since
+    `since`, with its name, language and totals, most quizzed first. Tables
+    that have been deleted are grouped together with a name of None."""
+    per_table = (select(QuizAttempt.table_id, *totals())
+            .where(QuizAttempt.user_id == user_id,
+                QuizAttempt.taken_at >= since)
+            .group_by(QuizAttempt.table_id)
+            .subquery())
+    return db.session.execute(select(Table.name.label("table_name"),
+                Language.name.label("language_name"), per_table.c.quizzes,
+                per_table.c.questions, per_table.c.right,
+                per_table.c.accuracy)
+            .select_from(per_table)
+            .outerjoin(Table, Table.id == per_table.c.table_id)
+            .outerjoin(Language, Language.id == Table.language_id)
+            .order_by(per_table.c.quizzes.desc(), Table.name)).all()
+
+
+def overall_progress(user_id, since):
+    """Return the totals of all the user's quizzes since `since`."""
+    return db.session.execute(select(*totals())
+            .where(QuizAttempt.user_id == user_id,
+                QuizAttempt.taken_at >= since)).one()
+
+
+@bp.route("/progress")
+@login_required
+def progress():
+    """Show the user's quiz results over the last year, by day and by
+    table."""
+    user = User.query.filter_by(id=session["user_id"]).first()
+    since = utcnow() - PROGRESS_PERIOD
+    return render_template("progress.html", user=user,
+            overall=overall_progress(user.id, since),
+            days=daily_progress(user.id, since),
+            tables=table_progress(user.id, since))
@@ -0,0 +1,93 @@
+"""JSON API for taking a whole quiz in two requests, for clients where each
+round trip is expensive:
+
+    POST /api/quiz/<language_name>/<table_name>
+        Starts a quiz and returns its id and questions.
+
+    POST /api/quiz/<quiz_id>/answers
+        Takes {"answers": {"<word pair id>": "<answer>", ...}}, marks every
+        question, updates the Leitner boxes in one transaction and returns the
+        results. A quiz is only marked once; submitting it again gets a 409
+        while it is being marked and a 404 after.
+
+Both use the same session cookie as the rest of the site."""
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, session
+
+from mensable.models import Subscription, Table, User
+from mensable.quiz_state import quiz_store
+from mensable.quizzes import (finish_quiz, finish_review, mark_answer,
+        start_quiz)
+
+bp = Blueprint("quiz_api", __name__, url_prefix="/api")
+
+
+def api_login_required(f):
+    """Like auth.login_required, but answers 401 instead of redirecting."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id") is None:
+            return jsonify(error="Login required."), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@bp.route("/quiz/<language_name>/<table_name>", methods=["POST"])
+@api_login_required
+def start(language_name, table_name):
+    """Start a quiz and return all of its questions."""
+    table = Table.query.filter_by(name=table_name).first()
+    if not table:
+        return jsonify(error=f"Table {table_name} does not exist."), 404
+
+    user = User.query.filter_by(id=session["user_id"]).first()
+    quiz = start_quiz(user, table)
+    quiz_id = quiz_store.create(quiz)
+    questions = [{"id": question["id"], "foreignWord": question["foreignWord"]}
+            for question in quiz["to_test"]]
+    return jsonify(quiz_id=quiz_id, questions=questions)
+
+
+@bp.route("/quiz/<quiz_id>/answers", methods=["POST"])
+@api_login_required
+def answers(quiz_id):
+    """Mark every answer to a quiz and return the results."""
+    quiz = quiz_store.get(quiz_id)
+    if quiz is None or quiz["user_id"] != session["user_id"]:
+        return jsonify(error="Quiz not found or expired."), 404
+
+    data = request.get_json(silent=True) or {}
+    given = data.get("answers")
+    if not isinstance(given, dict):
+        return jsonify(error="Expected an 'answers' object."), 400
+
+    if "review" not in quiz:
+        sub = Subscription.query.filter_by(learner_id=quiz["user_id"],
+                table_id=quiz["table_id"]).first()
+        if sub is None:
+            quiz_store.delete(quiz_id)
+            return jsonify(error="No longer subscribed to this table."), 409
+
+    # Only the first of several submissions of the same quiz is marked.
+    if not quiz_store.claim(quiz_id):
+        return jsonify(error="Quiz already submitted."), 409
+
+    # Unanswered questions count as wrong.
+    for question in quiz["to_test"]:
+        mark_answer(quiz, question, str(given.get(str(question["id"]), "")))
+    quiz["to_test"] = []
+
+    if "review" in quiz:
+        results = finish_review(quiz)
+    else:
+        results = finish_quiz(sub, quiz)
+
+    return jsonify(
+            right_count=results["right_count"],
+            total_count=results["total_count"],
+            percentage_score=results["percentage_score"],
+            right=[word_pair.id for word_pair in results["right_list"]],
+            wrong=[{"id": word_pair.id, "foreignWord": word_pair.foreignWord,
+                    "translation": word_pair.translation}
+                   for word_pair in results["wrong_list"]])
@@ -0,0 +1,144 @@
+"""Server-side storage for quizzes in progress.
+
+The session cookie carries only an opaque quiz id; the quiz itself (its
+questions and the answers given so far) is kept by one of the backends below,
+chosen with the QUIZ_STATE_BACKEND config value. Every entry expires
+QUIZ_STATE_TTL seconds after it was last saved.
+
+- "sql" keeps quizzes in the quiz_state table of the app's database, so every
+  gunicorn worker sees the same quizzes. This is the default.
+- "memory" keeps quizzes in a dictionary in the worker process. It is only
+  suitable for a single worker, e.g. in development and tests."""
+import json
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from mensable import db
+from mensable.models import QuizState, utcnow
+
+
+def new_quiz_id():
+    return secrets.token_hex(16)
+
+
+class MemoryQuizStore(object):
+    """Quiz state held in this process only."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def create(self, quiz):
+        quiz_id = new_quiz_id()
+        self.save(quiz_id, quiz)
+        return quiz_id
+
+    def get(self, quiz_id):
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[quiz_id]
+                return None
+            return json.loads(data)
+
+    def save(self, quiz_id, quiz):
+        # Store a serialized copy, as the SQL backend does, so callers never
+        # share a mutable dictionary between requests.
+        now = time.monotonic()
+        with self._lock:
+            self._entries[quiz_id] = (json.dumps(quiz), now + self.ttl)
+            for expired in [key for key, (_, expires) in self._entries.items()
+                    if expires <= now]:
+                del self._entries[expired]
+
+    def delete(self, quiz_id):
+        with self._lock:
+            self._entries.pop(quiz_id, None)
+
+    def claim(self, quiz_id):
+        with self._lock:
+            return self._entries.pop(quiz_id, None) is not None
+
+
+class SQLQuizStore(object):
+    """Quiz state held in the quiz_state table, shared by all workers."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def create(self, quiz):
+        # Clear out abandoned quizzes whenever a new one starts.
+        QuizState.query.filter(QuizState.expires_at <= utcnow()).delete()
+        quiz_id = new_quiz_id()
+        db.session.add(QuizState(quiz_id, json.dumps(quiz), self._expiry()))
+        db.session.commit()
+        return quiz_id
+
+    def get(self, quiz_id):
+        state = QuizState.query.filter_by(id=quiz_id).first()
+        if state is None or state.expires_at <= utcnow():
+            return None
+        return json.loads(state.data)
+
+    def save(self, quiz_id, quiz):
+        QuizState.query.filter_by(id=quiz_id).update(
+                {"data": json.dumps(quiz), "expires_at": self._expiry()})
+        db.session.commit()
+
+    def delete(self, quiz_id):
+        QuizState.query.filter_by(id=quiz_id).delete()
+        db.session.commit()
+
+    def claim(self, quiz_id):
+        # Not committed, so a concurrent claim waits on the row until the
+        # results are committed with the deletion, then finds nothing.
+        return QuizState.query.filter_by(id=quiz_id).delete() == 1
+
+    def _expiry(self):
+        return utcnow() + timedelta(seconds=self.ttl)
+
+
+BACKENDS = {"memory": MemoryQuizStore, "sql": SQLQuizStore}
+
+
+class QuizStore(object):
+    """Forwards to the backend configured for the app."""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        backend = BACKENDS[app.config["QUIZ_STATE_BACKEND"]]
+        self.backend = backend(app.config["QUIZ_STATE_TTL"])
+
+    def create(self, quiz):
+        """Store a new quiz and return its id."""
+        return self.backend.create(quiz)
+
+    def get(self, quiz_id):
+        """Return the quiz with this id, or None if it is unknown or has
+        expired."""
+        return self.backend.get(quiz_id)
+
+    def save(self, quiz_id, quiz):
+        """Store changes to a quiz and extend its expiry."""
+        self.backend.save(quiz_id, quiz)
+
+    def delete(self, quiz_id):
+        self.backend.delete(quiz_id)
+
+    def claim(self, quiz_id):
+        """Delete a quiz before applying its results, and return whether this
+        call deleted it, so only one of several concurrent submissions is
+        applied. The SQL backend leaves the deletion to be committed with the
+        results."""
+        return self.backend.claim(quiz_id)
+
+
+quiz_store = QuizStore()
@@ -0,0 +1,202 @@
+"""Starting, marking and finishing quizzes.
+
+Shared by the page-by-page quiz in api.py and the JSON quiz API in
+quiz_api.py. A quiz is a plain dictionary, kept between requests by
+quiz_state.quiz_store."""
+from datetime import date
+from random import shuffle
+
+import Levenshtein
+
+from mensable import db
+from mensable.leitner import (due_word_ids, review_word_ids, subscribe,
+        update_boxes, update_review_boxes)
+from mensable.models import QuizAttempt, Subscription
+from mensable.words import get_word_pair_lists, get_word_pairs
+
+QUIZ_LENGTH = 6
+
+# Version of the records written by encode_results.
+RESULTS_FORMAT = 1
+
+
+def start_quiz(user, table, length=QUIZ_LENGTH):
+    """Return a new quiz on the `length` highest-priority words in a table,
+    subscribing the user to the table first if necessary."""
+    # Check if user is subscribed to table yet, and create subscription if not.
+    sub = Subscription.query.filter_by(learner_id=user.id, table_id=table.id).first()
+    if not sub:
+        sub = subscribe(user, table)
+        db.session.commit()
+
+    # Load the IDs of the word pairs most overdue for review.
+    word_ids = due_word_ids(sub, length)
+    shuffle(word_ids)
+    quiz = new_quiz(user, word_ids)
+    quiz["table_id"] = table.id
+    return quiz
+
+
+def start_review(user, language=None, length=QUIZ_LENGTH):
+    """Return a new quiz on the `length` most overdue words across all of
+    the user's subscriptions, or those to tables in one language."""
+    pairs = review_word_ids(user.id, length, language and language.id)
+    shuffle(pairs)
+    quiz = new_quiz(user, [word_id for _, word_id in pairs])
+    # Each question's subscription, in the order of word_ids.
+    subscription_ids = dict((word_id, sub_id) for sub_id, word_id in pairs)
+    quiz["subscription_ids"] = [subscription_ids[word_id]
+            for word_id in quiz["word_ids"]]
+    quiz["table_id"] = None
+    quiz["review"] = language.name if language else ""
+    return quiz
+
+
+def new_quiz(user, word_ids):
+    # Keep the text of each question with the quiz so that asking and marking
+    # it needs no further word queries.
+    to_test = [{"id": word_pair.id,
+                "foreignWord": word_pair.foreignWord,
+                "translation": word_pair.translation}
+               for word_pair in get_word_pairs(word_ids)]
+    return {"total_count": len(to_test),
+            "word_ids": [question["id"] for question in to_test],
+            "to_test": to_test,
+            "right_list": [],
+            "wrong_list": [],
+            "right_count": 0,
+            "user_id": user.id}
+
+
+def mark_answer(quiz, question, answer):
+    """Record whether `answer` is a correct translation for one of the quiz's
+    questions, returning True if it is."""
+    if compare_strings(answer, question["translation"]):
+        quiz["right_list"].append(question["id"])
+        quiz["right_count"] += 1
+        return True
+    quiz["wrong_list"].append(question["id"])
+    return False
+
+
+def finish_quiz(sub, quiz):
+    """Apply a finished quiz to the subscription's Leitner boxes and
+    statistics in a single transaction, and return its results."""
+    update_boxes(sub, quiz["right_list"], quiz["wrong_list"])
+    results = summarize(quiz, *get_word_pair_lists(quiz["wrong_list"],
+        quiz["right_list"]))
+    record_results(sub, results)
+    db.session.commit()
+    return results
+
+
+def finish_review(quiz):
+    """Apply a finished review quiz to the Leitner boxes and statistics of
+    each subscription it drew words from, in a single transaction, and return
+    its results."""
+    subscription_ids = dict(zip(quiz["word_ids"], quiz["subscription_ids"]))
+    update_review_boxes([(subscription_ids[word_id], word_id)
+                for word_id in quiz["right_list"]],
+            [(subscription_ids[word_id], word_id)
+                for word_id in quiz["wrong_list"]])
+    wrong_list, right_list = get_word_pair_lists(quiz["wrong_list"],
+            quiz["right_list"])
+    results = summarize(quiz, wrong_list, right_list)
+
+    # Each subscription gets the results of its own words.
+    subs = Subscription.query.filter(
+            Subscription.id.in_(set(quiz["subscription_ids"]))).all()
+    for sub in subs:
+        word_ids = set(word_id for word_id, sub_id in subscription_ids.items()
+                if sub_id == sub.id)
+        part = {"total_count": len(word_ids),
+                "word_ids": [word_id for word_id in quiz["word_ids"]
+                    if word_id in word_ids],
+                "right_count": len(word_ids & set(quiz["right_list"])),
+                "table_id": sub.table_id,
+                "user_id": quiz["user_id"]}
+        record_results(sub, summarize(part,
+                [word_pair for word_pair in wrong_list
+                    if word_pair.id in word_ids],
+                [word_pair for word_pair in right_list
+                    if word_pair.id in word_ids]))
+    db.session.commit()
+    return results
+
+
+def summarize(quiz, wrong_list, right_list):
+    """Return the results of a finished quiz, given its wrong and right
+    answers as word pairs."""
+    # Convert quiz data into more detailed results dictionary
+    results = quiz.copy()
+    results["wrong_list"], results["right_list"] = wrong_list, right_list
+    if results["total_count"]:
+        results["percentage_score"] = int(results["right_count"] /
+                results["total_count"] * 100)
+    else:
+        results["percentage_score"] = 0
+    if results["percentage_score"] > 90:
+        headline = "Congrats! "
+    elif results["percentage_score"] > 60:
+        headline = "Not bad! "
+    else:
+        headline = "Better luck next time - "
+
+    headline += f"""
+               you scored {results['right_count']}/{results['total_count']}
+               ({results['percentage_score']}%)
+               """
+    results["headline"] = headline
+    return results
+
+
+def record_results(sub, results):
+    """Add a quiz's results to the user's history and the subscription's
+    statistics. Does not commit."""
+    db.session.add(QuizAttempt(sub.learner_id, sub.table_id,
+            results["total_count"], results["right_count"]))
+
+    # Save the most recent results to the subscription, by word pair id.
+    sub.last_quiz_record = encode_results(results)
+    sub.last_percentage_score = results["percentage_score"]
+    sub.quiz_attempts += 1
+    sub.total_questions += results["total_count"]
+    sub.total_right += results["right_count"]
+    if sub.total_questions:
+        sub.average_percentage_score = int(sub.total_right /
+                sub.total_questions * 100)
+    sub.last_quiz_date = date.today()
+
+
+def encode_results(results):
+    """Return a compact record of a quiz's results, for JSON: the ids of the
+    word pairs answered right and wrong, and the counts. "v" is the version
+    of the format."""
+    return {"v": RESULTS_FORMAT,
+            "wrong": [word_pair.id for word_pair in results["wrong_list"]],
+            "right": [word_pair.id for word_pair in results["right_list"]],
+            "total_count": results["total_count"],
+            "right_count": results["right_count"]}
+
+
+def last_results(sub):
+    """Return the results of the subscription's last quiz, as `summarize`
+    makes them, or {} if it has none."""
+    record = sub.last_quiz_record
+    if not record:
+        return {}
+    return summarize({"total_count": record["total_count"],
+            "right_count": record["right_count"]},
+        *get_word_pair_lists(record["wrong"], record["right"]))
+
+
+def compare_strings(s1, s2):
+    """Soft string comparison, converts to lower case and removes whitespace,
+    allows for typos up to a Levenshtein distance of 2"""
+    s1 = s1.lower()
+    s2 = s2.lower()
+    s1 = s1.replace(" ", "")
+    s2 = s2.replace(" ", "")
+    if Levenshtein.distance(s1, s2) <= 2:
+        return True
+    return False
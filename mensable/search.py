@@ -0,0 +1,167 @@
+"""Fuzzy search of word pairs, backed by a trigram index.
+
+The index holds a WordTrigram row for each three-character piece of every
+word pair's foreign word and translation, normalized as compare_strings
+normalizes answers. Code that adds word pairs must call `index_word_pairs`;
+entries are deleted with their word pairs by the database.
+
+A word within a Levenshtein distance of 2 of the query, the tolerance of
+compare_strings, has all but at most 6 of the query's trigrams, since each
+edit changes at most 3. So a search reads the index entries of the query's
+rarest trigrams, takes the word pairs with the most of them, and checks those
+with compare_strings. The cost of a search is bounded by skipping trigrams
+found in COMMON_TRIGRAM or more word pairs, which may miss matches that only
+have common trigrams (such as those starting a word) in common with the
+query.
+
+A query of SHORT_QUERY characters or fewer has at most 6 trigrams, so a word
+within the tolerance may share none of them, e.g. "xatxe" for "katze". Only
+matches sharing at least one trigram with such a query are found, since
+finding the rest would take a scan of every word pair."""
+from functools import lru_cache
+
+import Levenshtein
+from sqlalchemy import String, bindparam, desc, func, select, union_all
+
+from mensable import db
+from mensable.models import WordPair, WordTrigram, table_word_pair
+from mensable.quizzes import compare_strings
+from mensable.words import get_word_pairs
+
+# Most edits allowed by compare_strings, and trigrams changed by one edit.
+MAX_DISTANCE = 2
+TRIGRAMS_PER_EDIT = 3
+
+# Longest normalized query that a match may share no trigrams with: it has
+# one trigram per character plus one, and each edit changes up to three.
+SHORT_QUERY = MAX_DISTANCE * TRIGRAMS_PER_EDIT - 1
+
+# Most word pairs checked with compare_strings per search.
+SEARCH_CANDIDATES = 200
+
+# Trigrams in at least this many word pairs, such as those at the start of
+# words, are too common to be worth reading from the index.
+COMMON_TRIGRAM = 5000
+
+# Longest query searched for; word pairs are at most 100 characters long.
+MAX_QUERY_LENGTH = 100
+
+# Word pairs indexed per INSERT.
+INDEX_BATCH_SIZE = 1000
+
+
+def normalize(text):
+    return text.lower().replace(" ", "")
+
+
+def trigrams(text):
+    """Return the set of trigrams in a normalized string, padded so that
+    short strings and the ends of strings have trigrams too."""
+    padded = f"  {normalize(text)} "
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def index_word_pairs(word_pairs):
+    """Add word pairs to the trigram index. Does not commit."""
+    rows = [{"trigram": trigram, "word_pair_id": word_pair.id}
+            for word_pair in word_pairs
+            for trigram in trigrams(word_pair.foreignWord)
+                | trigrams(word_pair.translation)]
+    for start in range(0, len(rows), INDEX_BATCH_SIZE):
+        db.session.execute(WordTrigram.__table__.insert(),
+                rows[start:start + INDEX_BATCH_SIZE])
+
+
+def index_missing_word_pairs():
+    """Index every word pair that is not in the trigram index yet, e.g. those
+    added before it existed. Returns the number of word pairs indexed."""
+    indexed = 0
+    while True:
+        batch = (WordPair.query
+                .filter(~select(WordTrigram.word_pair_id)
+                    .where(WordTrigram.word_pair_id == WordPair.id).exists())
+                .order_by(WordPair.id)
+                .limit(INDEX_BATCH_SIZE)
+                .all())
+        if not batch:
+            return indexed
+        index_word_pairs(batch)
+        db.session.commit()
+        indexed += len(batch)
+
+
+@lru_cache(maxsize=None)
+def trigram_count_query(size, cap):
+    """Return a query counting the word pairs containing each of `size`
+    trigrams, given as parameters t0, t1, ..., counting no higher than `cap`.
+    Queries are built once per size, as building them takes longer than
+    running them."""
+    return union_all(*[select(bindparam(f"t{i}", type_=String).label("trigram"),
+                func.count().label("word_pairs"))
+            .select_from(select(WordTrigram.word_pair_id)
+                .where(WordTrigram.trigram == bindparam(f"t{i}", type_=String))
+                .limit(cap).subquery())
+            for i in range(size)])
+
+
+def trigram_counts(query_trigrams):
+    """Return the number of word pairs containing each of the trigrams,
+    counting no higher than COMMON_TRIGRAM, in a single query."""
+    query = trigram_count_query(len(query_trigrams), COMMON_TRIGRAM)
+    return dict(db.session.execute(query, {f"t{i}": trigram
+        for i, trigram in enumerate(query_trigrams)}).all())
+
+
+def distance(query, word_pair):
+    """Return the Levenshtein distance between a query and the closer of a
+    word pair's foreign word and translation, once normalized."""
+    query = normalize(query)
+    return min(Levenshtein.distance(query, normalize(word_pair.foreignWord)),
+            Levenshtein.distance(query, normalize(word_pair.translation)))
+
+
+def search_word_pairs(query, language_id=None, table_id=None, limit=50):
+    """Return up to `limit` WordPairSnapshots whose foreign word or
+    translation matches `query` as an answer would, optionally only those in
+    a language or table. Closer matches come first. Queries of SHORT_QUERY
+    characters or fewer only find matches sharing a trigram with them."""
+    if not normalize(query):
+        return []
+    query_trigrams = trigrams(query[:MAX_QUERY_LENGTH])
+    min_shared = max(1, len(query_trigrams) - MAX_DISTANCE * TRIGRAMS_PER_EDIT)
+
+    # A word pair with min_shared of the query's trigrams has at least one
+    # of any len(query_trigrams) - min_shared + 1 of them, so only the
+    # entries for that many of the rarest trigrams need to be read. Common
+    # trigrams among those are skipped unless there is nothing rarer.
+    counts = trigram_counts(query_trigrams)
+    rarest = sorted(query_trigrams, key=lambda trigram: (counts[trigram],
+        trigram))[:len(query_trigrams) - min_shared + 1]
+    probe = [trigram for trigram in rarest
+            if counts[trigram] < COMMON_TRIGRAM] or rarest[:1]
+
+    shared = func.count(WordTrigram.trigram)
+    candidates = (select(WordTrigram.word_pair_id)
+            .where(WordTrigram.trigram.in_(probe))
+            .limit(SEARCH_CANDIDATES))
+    if len(probe) > 1:
+        candidates = (candidates.group_by(WordTrigram.word_pair_id)
+                .order_by(desc(shared), WordTrigram.word_pair_id))
+    if language_id is not None:
+        candidates = (candidates
+                .join(WordPair, WordPair.id == WordTrigram.word_pair_id)
+                .where(WordPair.language_id == language_id))
+    if table_id is not None:
+        candidates = (candidates
+                .join(table_word_pair,
+                    table_word_pair.c.word_pair_id == WordTrigram.word_pair_id)
+                .where(table_word_pair.c.table_id == table_id))
+
+    ids = [word_pair_id for (word_pair_id,) in db.session.execute(candidates)]
+    matches = [word_pair for word_pair in get_word_pairs(ids)
+            if compare_strings(query, word_pair.foreignWord)
+            or compare_strings(query, word_pair.translation)]
+    # The sort is stable, so word pairs equally close to the query stay in
+    # order of the trigrams they share with it.
+    matches.sort(key=lambda word_pair: distance(query, word_pair))
+    return matches[:limit]
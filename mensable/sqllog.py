@@ -0,0 +1,89 @@
+"""Logging of slow and sampled SQL statements, to the "mensable.sql" logger.
+
+- Statements slower than SQL_SLOW_QUERY_MS milliseconds are logged as
+  warnings, unless it is None.
+- A random SQL_LOG_SAMPLE_RATE fraction of all other statements is logged at
+  the info level, e.g. 1.0 logs every statement like SQLALCHEMY_ECHO did.
+- With SQL_LOG_REDACT set, only the number of parameters is logged rather
+  than their values, which may be passwords or users' words.
+
+Each entry names the endpoint of the request that ran the statement. A
+statement that is neither slow nor sampled is only timed, never formatted."""
+import logging
+import random
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from mensable import db
+
+logger = logging.getLogger("mensable.sql")
+
+# Longest parameter list logged when parameters are not redacted.
+MAX_PARAMETERS_LENGTH = 500
+
+
+class SQLLogger(object):
+    """Engine event handlers with the app's logging settings."""
+
+    def __init__(self, slow_query_ms, sample_rate, redact):
+        self.slow_query_seconds = (None if slow_query_ms is None
+                else slow_query_ms / 1000)
+        self.sample_rate = sample_rate
+        self.redact = redact
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+            context, executemany):
+        if context is not None:
+            context._sqllog_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+            context, executemany):
+        start = getattr(context, "_sqllog_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if (self.slow_query_seconds is not None
+                and elapsed >= self.slow_query_seconds):
+            level = logging.WARNING
+        elif self.sample_rate and random.random() < self.sample_rate:
+            level = logging.INFO
+        else:
+            return
+        if logger.isEnabledFor(level):
+            logger.log(level, "%.1fms %s: %s %s", elapsed * 1000,
+                    request.endpoint if has_request_context() else "-",
+                    statement, self.format_parameters(parameters, executemany))
+
+    def format_parameters(self, parameters, executemany):
+        if executemany:
+            return f"[{len(parameters)} parameter sets]"
+        if self.redact:
+            return f"[{len(parameters or ())} parameters]"
+        formatted = repr(parameters)
+        if len(formatted) > MAX_PARAMETERS_LENGTH:
+            formatted = formatted[:MAX_PARAMETERS_LENGTH] + "..."
+        return formatted
+
+
+def init_app(app):
+    """Log the app's slow and sampled statements. Call after db.init_app."""
+    sql_logger = SQLLogger(app.config["SQL_SLOW_QUERY_MS"],
+            app.config["SQL_LOG_SAMPLE_RATE"], app.config["SQL_LOG_REDACT"])
+    if sql_logger.slow_query_seconds is None and not sql_logger.sample_rate:
+        return
+
+    # Entries propagate to app.logger ("mensable"), which logs to stderr
+    # unless logging is configured elsewhere.
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO if sql_logger.sample_rate
+                else logging.WARNING)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute",
+                sql_logger.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute",
+                sql_logger.after_cursor_execute)
@@ -0,0 +1,64 @@
+"""Lookups of word pairs by id.
+
+Views that show several word pairs should resolve them here rather than
+querying for each id in turn, so the number of queries does not grow with
+the number of words shown. Results are immutable snapshots, cached per worker
+process in `word_pair_cache`. Code that changes or deletes word pairs must
+call `invalidate_word_pairs`; other workers see the change once their copy
+expires after WORD_PAIR_CACHE_TTL seconds."""
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from mensable import db
+from mensable.cache import LRUCache
+from mensable.models import WordPair
+
+WordPairSnapshot = namedtuple("WordPairSnapshot",
+        ["id", "foreignWord", "translation", "language_id"])
+
+word_pair_cache = LRUCache()
+
+
+def init_app(app):
+    word_pair_cache.maxsize = app.config["WORD_PAIR_CACHE_SIZE"]
+    word_pair_cache.ttl = app.config["WORD_PAIR_CACHE_TTL"]
+    word_pair_cache.clear()
+
+
+def invalidate_word_pairs(ids):
+    """Drop cached snapshots of the given word pairs in this process."""
+    word_pair_cache.invalidate(ids)
+
+
+def get_word_pair_lists(*id_lists):
+    """Resolve any number of lists of word pair ids, querying the database at
+    most once for the ids that are not cached. Returns one list of
+    WordPairSnapshots per list of ids, in the same order. Ids with no word
+    pair (e.g. deleted since they were recorded) are left out."""
+    found = {}
+    missing = set()
+    for word_pair_id in set(word_pair_id for ids in id_lists
+            for word_pair_id in ids):
+        snapshot = word_pair_cache.get(word_pair_id)
+        if snapshot is None:
+            missing.add(word_pair_id)
+        else:
+            found[word_pair_id] = snapshot
+
+    if missing:
+        # Plain rows are much cheaper to load than WordPair objects.
+        for row in db.session.execute(select(WordPair.id, WordPair.foreignWord,
+                WordPair.translation, WordPair.language_id)
+                .where(WordPair.id.in_(missing))):
+            snapshot = WordPairSnapshot(*row)
+            word_pair_cache.set(snapshot.id, snapshot)
+            found[snapshot.id] = snapshot
+
+    return [[found[word_pair_id] for word_pair_id in ids
+        if word_pair_id in found] for ids in id_lists]
+
+
+def get_word_pairs(ids):
+    """Return WordPairSnapshots for the given ids, in the same order."""
+    return get_word_pair_lists(ids)[0]
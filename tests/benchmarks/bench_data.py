@@ -0,0 +1,91 @@
+"""Synthetic datasets for the route benchmarks."""
+from werkzeug.security import generate_password_hash
+
+from mensable import db
+from mensable.leitner import insert_missing_boxes
+from mensable.models import *
+from mensable.search import index_missing_word_pairs
+
+# Number of rows of each kind to seed.
+DATASETS = {
+    "small": {"users": 10, "languages": 3, "tables": 100, "words": 10000,
+              "subscriptions_per_user": 5},
+    "medium": {"users": 100, "languages": 10, "tables": 1000, "words": 100000,
+               "subscriptions_per_user": 10},
+    "large": {"users": 1000, "languages": 10, "tables": 10000,
+              "words": 1000000, "subscriptions_per_user": 10},
+}
+
+# Rows per executemany() call while seeding.
+SEED_BATCH_SIZE = 10000
+
+
+def language_name(n):
+    # Language names may only contain letters and spaces.
+    letters = ""
+    n += 1
+    while n:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return f"Lang {letters}"
+
+
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz"
+        for vowel in "aeiou"]
+
+
+def pseudo_word(n):
+    """Return a distinct made-up word for each n, so that the trigrams of
+    seeded words are spread out like those of real vocabulary."""
+    syllables = []
+    for _ in range(3):
+        n, remainder = divmod(n, len(SYLLABLES))
+        syllables.append(SYLLABLES[remainder])
+    while n:
+        n, remainder = divmod(n - 1, len(SYLLABLES))
+        syllables.append(SYLLABLES[remainder])
+    return "".join(syllables)
+
+
+def insert_rows(table, rows):
+    for start in range(0, len(rows), SEED_BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + SEED_BATCH_SIZE])
+
+
+def seed(sizes):
+    """Fill the database with a synthetic dataset using bulk inserts. Table
+    `n` is in language `n % languages`, word pair `n` is in table
+    `n % tables`, and every user subscribes to the first few tables."""
+    password_hash = generate_password_hash("benchpwd")
+    insert_rows(User.__table__, [{"id": n + 1, "name": f"bench_user_{n}",
+        "password_hash": password_hash} for n in range(sizes["users"])])
+    insert_rows(Language.__table__, [{"id": n + 1, "name": language_name(n)}
+        for n in range(sizes["languages"])])
+    insert_rows(Table.__table__, [{"id": n + 1, "name": f"Table {n}",
+        "creator_id": n % sizes["users"] + 1,
+        "language_id": n % sizes["languages"] + 1}
+        for n in range(sizes["tables"])])
+
+    word_rows, link_rows = [], []
+    for n in range(sizes["words"]):
+        table_n = n % sizes["tables"]
+        word_rows.append({"id": n + 1, "foreignWord": pseudo_word(n),
+            "translation": pseudo_word(n * 7919 + 13)[::-1],
+            "language_id": table_n % sizes["languages"] + 1})
+        link_rows.append({"word_pair_id": n + 1, "table_id": table_n + 1})
+    insert_rows(WordPair.__table__, word_rows)
+    insert_rows(table_word_pair, link_rows)
+
+    sub_rows = []
+    for user_n in range(sizes["users"]):
+        for table_n in range(min(sizes["subscriptions_per_user"],
+                sizes["tables"])):
+            sub_rows.append({"learner_id": user_n + 1, "table_id": table_n + 1,
+                "quiz_attempts": 0, "total_questions": 0, "total_right": 0,
+                "last_quiz_date": "2022-01-01"})
+    insert_rows(Subscription.__table__, sub_rows)
+    db.session.commit()
+
+    insert_missing_boxes()
+    db.session.commit()
+    index_missing_word_pairs()
@@ -0,0 +1,55 @@
+"""Compare two benchmark reports written by the route benchmarks.
+
+    python tests/benchmarks/compare.py OLD.json NEW.json [--threshold 1.2]
+
+Prints the change in median latency and query count of every route measured
+in both reports, and exits with status 1 if any route's median latency grew
+by more than `threshold` times or it runs more queries than before."""
+import argparse
+import json
+import sys
+
+
+def load_routes(path):
+    """Map (dataset, route) to the route's summary in a report."""
+    with open(path) as report_file:
+        report = json.load(report_file)
+    return {(run["dataset"], route): summary
+            for run in report["runs"]
+            for route, summary in run["routes"].items()}
+
+
+def compare(old, new, threshold):
+    """Return a line of text for each route in both reports, and whether any
+    of them regressed."""
+    lines, regressed = [], False
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        ratio = after["p50_ms"] / before["p50_ms"] if before["p50_ms"] else 1
+        extra_queries = after["queries_max"] - before["queries_max"]
+        flag = ""
+        if ratio > threshold or extra_queries > 0:
+            flag, regressed = "  REGRESSION", True
+        lines.append(f"{key[0]:<8} {key[1]:<32} "
+                     f"{before['p50_ms']:9.2f}ms {after['p50_ms']:9.2f}ms "
+                     f"{ratio:5.2f}x {before['queries_max']:4d} -> "
+                     f"{after['queries_max']:4d} queries{flag}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2,
+            help="largest allowed ratio of new to old median latency")
+    args = parser.parse_args(argv)
+
+    lines, regressed = compare(load_routes(args.old), load_routes(args.new),
+            args.threshold)
+    print("\n".join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
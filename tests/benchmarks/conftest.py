@@ -0,0 +1,119 @@
+"""Fixtures for the route benchmarks in this directory.
+
+The benchmarks are skipped unless MENSABLE_BENCHMARK is set. Other settings:
+
+    MENSABLE_BENCH_DATASETS  Comma-separated names from DATASETS (default
+                             "small").
+    MENSABLE_BENCH_REPEAT    Requests timed per route (default 20).
+    MENSABLE_BENCH_DATABASE  Database URI to seed and benchmark against
+                             (default an in-memory SQLite database). It is
+                             emptied before each dataset is seeded.
+    MENSABLE_BENCH_OUTPUT    Where to write the JSON report (default
+                             bench_results.json).
+
+Compare two reports with `python tests/benchmarks/compare.py old new`."""
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from bench_data import DATASETS, seed
+from mensable import create_app, db
+
+
+def selected_datasets():
+    names = os.getenv("MENSABLE_BENCH_DATASETS", "small")
+    return [name.strip() for name in names.split(",")]
+
+
+class Recorder(object):
+    """Times requests and counts the SQL statements they run."""
+
+    def __init__(self, client, engine):
+        self.client = client
+        self._engine = engine
+        self.routes = {}
+
+    def request(self, name, method, route, **kwargs):
+        statements = [0]
+
+        def count(*args):
+            statements[0] += 1
+
+        event.listen(self._engine, "before_cursor_execute", count)
+        start = time.perf_counter()
+        try:
+            response = self.client.open(route, method=method, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            event.remove(self._engine, "before_cursor_execute", count)
+        assert response.status_code < 400, f"{name}: {response.status_code}"
+
+        samples = self.routes.setdefault(name, {"ms": [], "queries": []})
+        samples["ms"].append(elapsed * 1000)
+        samples["queries"].append(statements[0])
+        return response
+
+    def summary(self):
+        return {name: {"samples": len(samples["ms"]),
+                       "p50_ms": percentile(samples["ms"], 0.5),
+                       "p90_ms": percentile(samples["ms"], 0.9),
+                       "p99_ms": percentile(samples["ms"], 0.99),
+                       "max_ms": max(samples["ms"]),
+                       "queries_p50": percentile(samples["queries"], 0.5),
+                       "queries_max": max(samples["queries"])}
+                for name, samples in self.routes.items()}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+@pytest.fixture(scope="session")
+def bench_report():
+    """Collects the results of every benchmark and writes them out as JSON
+    at the end of the session."""
+    report = {"created": datetime.utcnow().isoformat(timespec="seconds"),
+              "runs": []}
+    yield report
+    if report["runs"]:
+        path = os.getenv("MENSABLE_BENCH_OUTPUT", "bench_results.json")
+        with open(path, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+@pytest.fixture(scope="module", params=selected_datasets())
+def dataset(request):
+    """The name and sizes of the dataset being benchmarked."""
+    return request.param, DATASETS[request.param]
+
+
+@pytest.fixture(scope="module")
+def app(dataset):
+    """Replaces the app fixture from tests/conftest.py with one seeded with
+    a dataset, shared by a module's benchmarks. The client, auth and api
+    fixtures then work against it as usual."""
+    name, sizes = dataset
+    uri = os.getenv("MENSABLE_BENCH_DATABASE", "sqlite:///:memory:")
+    # Jobs run inline, so the upload_csv benchmark times the import itself.
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": uri,
+        "JOB_WORKERS": 0})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(sizes)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def recorder(app, client):
+    with app.app_context():
+        engine = db.engine
+    return Recorder(client, engine)
@@ -0,0 +1,83 @@
+"""Per-route latency and SQL query counts against seeded datasets. See
+conftest.py in this directory for how to run them."""
+import io
+import os
+
+import pytest
+
+from bench_data import pseudo_word
+
+pytestmark = pytest.mark.skipif(not os.getenv("MENSABLE_BENCHMARK"),
+        reason="set MENSABLE_BENCHMARK=1 to run benchmarks")
+
+# Requests timed per route.
+REPEAT = int(os.getenv("MENSABLE_BENCH_REPEAT", "20"))
+
+# Rows in each CSV file uploaded by the upload_csv benchmark.
+CSV_ROWS = 1000
+
+
+def test_routes(dataset, client, auth, api, recorder, bench_report):
+    name, sizes = dataset
+    auth.register()
+
+    # The benchmark user creates their own table in the first language, and
+    # quizzes on the most popular seeded table.
+    language, table = "Lang A", "Table 0"
+    api.create_table("Bench table", language)
+    for n in range(20):
+        api.add_word_pair(f"bench{n}", f"translation{n}",
+                language_name=language, table_name="Bench table")
+    client.get(f"/quiz/{language}/{table}")
+    client.get(f"/results/{language}/{table}")
+
+    for n in range(REPEAT):
+        recorder.request("GET /", "GET", "/")
+        recorder.request("GET /tables", "GET", "/tables")
+        recorder.request("GET /tables/<language>", "GET", f"/tables/{language}")
+        recorder.request("GET /languages", "GET", "/languages")
+        recorder.request("GET /view_table", "GET", f"/view_table/{language}/{table}")
+        # A misspelling of one of the seeded words.
+        word = pseudo_word(n * 37 % sizes["words"])
+        recorder.request("GET /search", "GET",
+                f"/search?q={word[1] + word[0] + word[2:]}")
+
+        # A complete quiz, one request at a time.
+        recorder.request("GET /quiz (start)", "GET", f"/quiz/{language}/{table}")
+        while True:
+            response = recorder.request("GET /quiz (question)", "GET",
+                    f"/quiz/{language}/{table}")
+            if response.status_code == 302:
+                break
+            recorder.request("POST /quiz", "POST", f"/quiz/{language}/{table}",
+                    data={"answer": "translation"})
+        recorder.request("GET /results", "GET", f"/results/{language}/{table}")
+
+        # A review of all of the user's subscriptions.
+        recorder.request("GET /review (start)", "GET", "/review")
+        while True:
+            response = recorder.request("GET /review (question)", "GET",
+                    "/review")
+            if response.status_code == 302:
+                break
+            recorder.request("POST /review", "POST", "/review",
+                    data={"answer": "translation"})
+        recorder.request("GET /review_results", "GET", "/review_results")
+
+        # The same quiz through the JSON API.
+        response = recorder.request("POST /api/quiz", "POST",
+                f"/api/quiz/{language}/{table}")
+        answers = {str(question["id"]): "translation"
+                for question in response.json["questions"]}
+        recorder.request("POST /api/quiz/answers", "POST",
+                f"/api/quiz/{response.json['quiz_id']}/answers",
+                json={"answers": answers})
+
+        rows = "".join(f"upload{n}x{row},translation{row}\n"
+                for row in range(CSV_ROWS))
+        recorder.request("POST /upload_csv", "POST",
+                f"/upload_csv/{language}/Bench table",
+                data={"csv_file": (io.BytesIO(rows.encode()), "words.csv")})
+
+    bench_report["runs"].append({"dataset": name, "sizes": sizes,
+        "repeat": REPEAT, "routes": recorder.summary()})
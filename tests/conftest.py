@@ -1,4 +1,6 @@
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 
 from mensable import create_app, db
@@ -7,7 +9,9 @@ from mensable.models import *
 @pytest.fixture
 def app():
     app = create_app({"TESTING": True,
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PASSWORD_HASH_WORKERS": 0,
+        "JOB_WORKERS": 0})
 
     return app
 
@@ -17,6 +21,33 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def max_queries(app):
+    """Return a context manager which fails the test if the code inside it
+    runs more than `limit` SQL statements, e.g.
+
+        with max_queries(3):
+            client.get("/")
+    """
+    @contextmanager
+    def counter(limit):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert len(statements) <= limit, "\n\n".join(statements)
+
+    return counter
+
+
 class AuthActions(object):
 
     username = "testuser"
@@ -1,8 +1,12 @@
+import io
+
 import pytest
 from flask import session
 from werkzeug.datastructures import FileStorage
 
+from mensable import api as api_module, db
 from mensable.models import *
+from mensable.quiz_state import quiz_store
 
 
 def test_home(client, auth):
@@ -94,6 +98,10 @@ def test_edit_table(app, client, auth, api):
                     translation=translation).first()
             assert word_pair is None
 
+    # Re-adding an existing word does not add it to the table twice.
+    with app.app_context():
+        table = Table.query.filter_by(name=api.table_name).first()
+        assert len(table.words) == 1
 
     # Register and log in as a different user, confirm that attempts to edit
     # redirect to "/tables".
@@ -111,7 +119,11 @@ def test_upload_csv(app, client, auth, api):
     assert client.get(route).status_code == 200
     csv_file = FileStorage(stream=open("tests/test_table.csv", "rb"))
     response = client.post(route, data={"csv_file": csv_file})
-    assert response.headers["Location"] == f"/edit_table/{api.language_name}/{api.table_name}"
+    assert response.headers["Location"] == "/jobs/1"
+    response = client.get("/jobs/1")
+    assert b"Added: 2, " in response.data
+    assert f'href="/edit_table/{api.language_name}/{api.table_name}"'.encode() \
+            in response.data
     with app.app_context():
         table = Table.query.filter_by(name=api.table_name).first()
         assert len(table.words) == 2
@@ -119,6 +131,52 @@ def test_upload_csv(app, client, auth, api):
         assert word_pair is not None
 
 
+def test_import_word_pairs(app, client, auth, api, max_queries, monkeypatch):
+    auth.register()
+    api.add_full_stack()
+    api.create_table("Othertable")
+    route = f"/upload_csv/{api.language_name}/Othertable"
+
+    def upload(text):
+        csv_file = FileStorage(stream=io.BytesIO(text.encode("utf-8")),
+                filename="words.csv", content_type="text/csv")
+        response = client.post(route, data={"csv_file": csv_file})
+        return client.get(response.headers["Location"] + "?format=json").json
+
+    rows = ("foo,bar\n"
+            " foo ,bar\n"                     # Duplicate within the file
+            f"{api.foreignWord},x\n"          # Already in the language
+            "baz,qux\n"
+            ",empty\n"
+            "too,many,columns\n")
+    job = upload(rows)
+    assert job["state"] == "done"
+    assert job["result"] == {"added": 2, "reused": 2, "rejected": 2}
+    with app.app_context():
+        table = Table.query.filter_by(name="Othertable").first()
+        assert len(table.words) == 3
+
+    # Importing the same rows again adds nothing new to the table.
+    assert upload(rows)["result"] == {"added": 0, "reused": 4, "rejected": 2}
+    with app.app_context():
+        table = Table.query.filter_by(name="Othertable").first()
+        assert len(table.words) == 3
+        assert WordPair.query.count() == 3
+
+    # A batch of new word pairs is inserted in one statement, so the number
+    # of statements depends on the number of batches, not rows.
+    monkeypatch.setattr(api_module, "IMPORT_BATCH_SIZE", 100)
+    rows = "".join(f"word{n},translation{n}\n" for n in range(250))
+    with max_queries(45) as statements:
+        job = upload(rows)
+    assert job["result"] == {"added": 250, "reused": 0, "rejected": 0}
+    assert len([statement for statement in statements
+            if statement.startswith("INSERT INTO word_pair")]) == 3
+    with app.app_context():
+        assert WordPair.query.filter(WordPair.foreignWord.like("word%")) \
+                .count() == 250
+
+
 def test_delete_word(app, client, auth, api):
     auth.register()
     route = f"/delete_word/{api.language_name}/{api.table_name}"
@@ -137,17 +195,48 @@ def test_delete_word(app, client, auth, api):
         word_pair = WordPair.query.filter_by(foreignWord=api.foreignWord).first()
         assert word_pair is None
 
+    # A word in two tables is only removed from the one it is deleted from.
+    api.add_word_pair()
+    api.create_table("OtherTable")
+    api.add_word_pair(table_name="OtherTable")
+    with app.app_context():
+        word_pair = WordPair.query.filter_by(foreignWord=api.foreignWord).one()
+    client.post(route, data={"word_pair_id": word_pair.id})
+    with app.app_context():
+        assert WordPair.query.count() == 1
+        assert [table.name for table in WordPair.query.one().contained_in] == [
+                "OtherTable"]
+        assert LeitnerBox.query.count() == 1
+
 
-def test_delete_table(app, client, auth, api):
+def test_delete_table(app, client, auth, api, max_queries):
     auth.register()
     route = f"/delete_table/{api.language_name}/{api.table_name}"
     api.add_full_stack()
     assert client.get(route).status_code == 200
-    response = client.post(route)
-    assert response.headers["Location"] == "/tables/Testese"
+    api.add_word_pair("Foo", "Bar")
+    api.create_table("OtherTable")
+    api.add_word_pair("Foo", "Bar", table_name="OtherTable")
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+
+    # The table, its subscription, boxes and links go in one statement, then
+    # the orphaned word pairs in a batch; the rest is the job's bookkeeping.
+    with max_queries(17) as statements:
+        response = client.post(route)
+    assert response.headers["Location"] == "/jobs/1"
+    deletes = [statement for statement in statements
+            if statement.startswith("DELETE")]
+    assert [statement.split(" WHERE")[0] for statement in deletes] == [
+            'DELETE FROM "table"', "DELETE FROM word_pair"]
+    assert client.get("/jobs/1?format=json").json["result"] == {
+            "deleted_word_pairs": 1}
     with app.app_context():
         table = Table.query.filter_by(name=api.table_name).first()
         assert table is None
+        assert Subscription.query.count() == 1
+        assert LeitnerBox.query.count() == 1
+        assert [word_pair.foreignWord for word_pair in WordPair.query] == ["Foo"]
+        assert WordTrigram.query.filter(WordTrigram.word_pair_id != 2).count() == 0
 
 
 def test_view_table(client, auth, api):
@@ -177,6 +266,173 @@ def test_languages_and_tables(client, auth, api):
     assert client.get(f"/tables/{api.language_name}").status_code == 200
 
 
+def test_listing_query_counts(client, auth, api, max_queries):
+    # Listing pages must not issue extra queries per row.
+    auth.register()
+    for language_name in ["Testese", "Otherese", "Thirdese"]:
+        for n in range(3):
+            api.add_full_stack(table_name=f"{language_name}{n}",
+                    language_name=language_name)
+
+    with max_queries(2):
+        assert client.get("/").status_code == 200
+    with max_queries(2):
+        assert client.get("/tables").status_code == 200
+    with max_queries(2):
+        assert client.get("/tables/Testese").status_code == 200
+    with max_queries(2):
+        assert client.get("/languages").status_code == 200
+
+    for n in range(5):
+        api.add_word_pair(f"word{n}", f"translation{n}", table_name="Testese0")
+    with max_queries(4):
+        assert client.get("/view_table/Testese/Testese0").status_code == 200
+
+
+def test_fragment_cache(client, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    route = f"/view_table/{api.language_name}/{api.table_name}"
+    client.get(route)
+    client.get("/tables")
+    client.get("/languages")
+
+    # Cached listings only need their version looked up.
+    with max_queries(1):
+        assert b"TestTable" in client.get("/tables").data
+    with max_queries(1):
+        assert b"Testese" in client.get("/languages").data
+    with max_queries(3):
+        assert b"Testo" in client.get(route).data
+
+    # Changes to a table are seen straight away.
+    api.add_word_pair("Neuo", "New")
+    assert b"Neuo" in client.get(route).data
+    client.post(f"/delete_word/{api.language_name}/{api.table_name}",
+            data={"word_pair_id": 2})
+    assert b"Neuo" not in client.get(route).data
+    api.create_table("OtherTable")
+    assert b"OtherTable" in client.get("/tables").data
+    assert b"OtherTable" in client.get(f"/tables/{api.language_name}").data
+
+    # Subscription statistics are the viewing user's own.
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+    api.quiz_response()
+    client.get(f"/results/{api.language_name}/{api.table_name}")
+    assert b"You have attempted a quiz" in client.get(route).data
+    auth.logout()
+    auth.register("otheruser")
+    auth.login("otheruser")
+    assert b"You have attempted a quiz" not in client.get(route).data
+
+
+@pytest.mark.parametrize("route", ["/tables", "/tables/Testese", "/languages",
+    "/view_table/Testese/TestTable"])
+def test_etags(client, auth, api, max_queries, route):
+    auth.register()
+    api.add_full_stack()
+    client.get("/")
+
+    response = client.get(route)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    # A version lookup is enough to tell the browser its copy is current.
+    with max_queries(2):
+        response = client.get(route, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.data
+
+    # Adding a table or a word changes the ETag.
+    api.create_table("OtherTable")
+    api.add_word_pair("Neuo", "New")
+    response = client.get(route, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_etags_per_user(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    route = f"/view_table/{api.language_name}/{api.table_name}"
+    etag = client.get(route).headers["ETag"]
+
+    # Finishing a quiz changes the statistics on the page.
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+    api.quiz_response()
+    client.get(f"/results/{api.language_name}/{api.table_name}")
+    new_etag = client.get(route).headers["ETag"]
+    assert new_etag != etag
+
+    # Other users see their own version of the page.
+    auth.logout()
+    auth.register("otheruser")
+    auth.login("otheruser")
+    response = client.get(route, headers={"If-None-Match": new_etag})
+    assert response.status_code == 200
+
+    # Pages with flashed messages are always sent in full.
+    other_etag = response.headers["ETag"]
+    api.create_language()
+    response = client.get(route, headers={"If-None-Match": other_etag})
+    assert response.status_code == 200
+
+
+def test_pagination(app, client, auth, api):
+    app.config["PAGE_SIZE"] = 2
+    auth.register()
+    api.create_language()
+    for n in range(3):
+        api.create_table(f"Table{chr(65 + n)}")
+    for n in range(5):
+        api.add_word_pair(f"word{n}", f"translation{n}", table_name="TableA")
+
+    # Follow the "Next page" links through the word list.
+    route = f"/view_table/{api.language_name}/TableA"
+    seen = []
+    pages = 0
+    while route:
+        html = client.get(route).get_data(as_text=True)
+        seen += [n for n in range(5) if f"word{n}<" in html]
+        pages += 1
+        if "Next page" in html:
+            after = html.split("?after=")[1].split('"')[0]
+            route = f"/view_table/{api.language_name}/TableA?after={after}"
+        else:
+            route = None
+    assert seen == [0, 1, 2, 3, 4]
+    assert pages == 3
+
+    html = client.get("/tables").get_data(as_text=True)
+    assert "TableA" in html and "TableB" in html and "TableC" not in html
+    html = client.get("/tables?after=2").get_data(as_text=True)
+    assert "TableC" in html and "Next page" not in html
+    assert "First page" in html
+
+
+def test_pagination_links_cached(app, client, auth, api):
+    app.config["PAGE_SIZE"] = 1
+    auth.register()
+    api.create_language()
+    for name in ["TableA", "TableB"]:
+        api.create_table(name)
+        api.add_word_pair(f"{name}word1", "translation1", table_name=name)
+        api.add_word_pair(f"{name}word2", "translation2", table_name=name)
+
+    # Links in cached pages do not depend on the URL of the request that
+    # filled the cache, e.g. a table reached with the wrong language name,
+    # or a cursor that is not a number.
+    client.get("/view_table/Otherese/TableA")
+    client.get("/tables?after=abc")
+    html = client.get(f"/view_table/{api.language_name}/TableA") \
+            .get_data(as_text=True)
+    assert f'href="/view_table/{api.language_name}/TableA?after=' in html
+    assert "Otherese" not in html
+    html = client.get("/tables").get_data(as_text=True)
+    assert "Next page" in html and "First page" not in html
+
+
 def test_quiz(app, client, auth, api):
     auth.register()
     route = f"/quiz/{api.language_name}/{api.table_name}"
@@ -200,7 +456,7 @@ def test_quiz(app, client, auth, api):
     assert client.get(route).headers["Location"] == results_route
     with client:
         assert client.get(results_route).status_code == 200
-        assert "quiz" not in session
+        assert "quiz_id" not in session
         # Refresh results page to check persistence
         assert client.get(results_route).status_code == 200
         
@@ -225,7 +481,7 @@ def test_quiz(app, client, auth, api):
     # Now go to results page to finish off the quiz
     with client:
         assert client.get(results_route).status_code == 200
-        assert "quiz" not in session
+        assert "quiz_id" not in session
 
     # Log in as new user and start a quiz to simulate subscription.
     auth.logout()
@@ -254,12 +510,30 @@ def test_results(app, client, auth, api):
             "right_count": 2,
             "table_id": 1}
 
+    with app.app_context():
+        quiz_id = quiz_store.create(quiz)
     with client.session_transaction() as session:
-        session["quiz"] = quiz
+        session["quiz_id"] = quiz_id
         
-    assert "quiz" in session
+    assert "quiz_id" in session
     assert client.get(route).status_code == 200
 
+    # Right answers move up a box, wrong answers go back to box 0.
+    with app.app_context():
+        boxes = {box.word_pair_id: box.box for box in LeitnerBox.query}
+        assert boxes == {1: 1, 2: 1, 3: 0}
+
+        # The subscription keeps only the ids and counts.
+        sub = Subscription.query.first()
+        assert sub.last_quiz_record == {"v": 1, "wrong": [3], "right": [1, 2],
+                "total_count": 3, "right_count": 2}
+        assert sub.last_percentage_score == 66
+
+    # Revisiting the page shows the words again.
+    response = client.get(route)
+    assert b"Not bad!" in response.data
+    assert b"baz" in response.data
+
 
 def test_unsubscribe(app, client, auth, api):
     auth.register()
@@ -276,3 +550,46 @@ def test_unsubscribe(app, client, auth, api):
         assert sub is None
 
     
+
+
+def test_review(app, client, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    api.add_full_stack("Uno", "One", language_name="Otherese",
+            table_name="OtherTable")
+    translations = {api.foreignWord: api.translation, "Uno": "One"}
+
+    # A review takes the most overdue words of every subscribed table.
+    assert client.get("/review").headers["Location"] == "/review"
+    asked = []
+    for _ in range(2):
+        page = client.get("/review").get_data(as_text=True)
+        word = next(word for word in translations if f"'{word}'" in page)
+        asked.append(word)
+        with max_queries(3):
+            client.post("/review", data={"answer": translations[word]})
+    assert sorted(asked) == sorted(translations)
+    assert client.get("/review").headers["Location"] == "/review_results"
+    response = client.get("/review_results")
+    assert b"2/2" in response.data
+
+    # Each subscription has had its own quiz.
+    with app.app_context():
+        assert [sub.quiz_attempts for sub in Subscription.query] == [1, 1]
+        assert [box.box for box in LeitnerBox.query] == [1, 1]
+        assert QuizAttempt.query.count() == 2
+
+    # A review of one language only asks about its tables.
+    client.get("/review/Otherese")
+    page = client.get("/review/Otherese").get_data(as_text=True)
+    assert "'Uno'" in page
+    client.post("/review/Otherese", data={"answer": "wrong"})
+    client.get("/review_results")
+    with app.app_context():
+        other = Table.query.filter_by(name="OtherTable").first()
+        sub = Subscription.query.filter_by(table_id=other.id).first()
+        assert sub.quiz_attempts == 2
+        assert LeitnerBox.query.filter_by(subscription_id=sub.id).one().box == 0
+
+    assert client.get("/review/Nolang").status_code == 302
+
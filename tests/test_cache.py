@@ -0,0 +1,36 @@
+import pytest
+
+from mensable.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1       # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.info() == {"hits": 3, "misses": 1, "size": 2, "maxsize": 2}
+
+
+def test_ttl_and_invalidation(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("mensable.cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    now[0] += 30
+    assert cache.get("a") == 1
+    cache.invalidate(["b"])
+    assert cache.get("b") is None
+    now[0] += 31
+    assert cache.get("a") is None
+    assert cache.info()["size"] == 0
+
+
+def test_disabled_cache():
+    cache = LRUCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
@@ -0,0 +1,47 @@
+from sqlalchemy import text
+
+from mensable import db
+from mensable.cleanup import collect_orphan_word_pairs
+from mensable.models import *
+
+
+def add_orphans(count):
+    db.session.execute(WordPair.__table__.insert(), [{"foreignWord": f"w{n}",
+        "translation": f"t{n}", "language_id": 1} for n in range(count)])
+    db.session.commit()
+
+
+def test_collect_orphan_word_pairs(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # Word pairs left in no table, e.g. by an interrupted collection.
+    with app.app_context():
+        add_orphans(5)
+        batches = []
+        assert collect_orphan_word_pairs(batch_size=2,
+                on_batch=batches.append) == 5
+        assert batches == [2, 4, 5]
+        assert [word_pair.foreignWord for word_pair in WordPair.query] == [
+                api.foreignWord]
+        assert collect_orphan_word_pairs() == 0
+
+
+def test_collect_command(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+    with app.app_context():
+        add_orphans(3)
+
+    result = app.test_cli_runner().invoke(args=["collect-orphans"])
+    assert "word_pairs: 3" in result.output
+
+
+def test_cascades_use_indexes(app):
+    # Deleting a word pair deletes its boxes, links and trigrams without
+    # scanning their tables.
+    with app.app_context():
+        for table in ["leitner_box", "table_word_pair", "word_trigram"]:
+            plan = db.session.execute(text("EXPLAIN QUERY PLAN DELETE FROM "
+                    f"{table} WHERE word_pair_id IN (1, 2)")).all()
+            assert "USING" in plan[0][-1], plan
@@ -0,0 +1,55 @@
+import json
+from io import BytesIO
+
+
+def test_export_table(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    api.add_word_pair("Zweio, zwei", "Two")
+
+    response = client.get("/export/Testese/TestTable")
+    assert response.is_streamed
+    assert response.mimetype == "text/csv"
+    assert "TestTable.csv" in response.headers["Content-Disposition"]
+    assert response.get_data(as_text=True).splitlines() == [
+            "Testo,Test", '"Zweio, zwei",Two']
+
+    response = client.get("/export/Testese/TestTable?format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.get_data(as_text=True)
+            .splitlines()]
+    assert [row["foreignWord"] for row in rows] == ["Testo", "Zweio, zwei"]
+    assert rows[0]["translation"] == "Test"
+
+    assert client.get("/export/Testese/TestTable?format=xml").status_code == 400
+    assert client.get("/export/Testese/NoTable").status_code == 302
+
+
+def test_export_language(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    api.create_table("OtherTable")
+    api.add_word_pair("Zweio", "Two", table_name="OtherTable")
+    api.add_full_stack("Uno", "One", language_name="Otherese",
+            table_name="ThirdTable")
+
+    response = client.get("/export/Testese")
+    assert response.get_data(as_text=True).splitlines() == [
+            "Testo,Test", "Zweio,Two"]
+    assert client.get("/export/Nolang").status_code == 302
+
+
+def test_export_round_trip(client, auth, api):
+    # Exported CSV files can be uploaded into another table.
+    auth.register()
+    api.add_full_stack()
+    api.add_word_pair("Zweio, zwei", "Two")
+    exported = client.get("/export/Testese/TestTable").data
+
+    api.add_full_stack("Uno", "One", language_name="Otherese",
+            table_name="OtherTable")
+    client.post("/upload_csv/Otherese/OtherTable",
+            data={"csv_file": (BytesIO(exported), "TestTable.csv")})
+    response = client.get("/export/Otherese/OtherTable")
+    assert response.get_data(as_text=True).splitlines() == [
+            "Uno,One", "Testo,Test", '"Zweio, zwei",Two']
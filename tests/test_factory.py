@@ -11,3 +11,10 @@ def test_config():
     # Create app in testing mode.
     assert create_app({"TESTING": True, 
         "SQLALCHEMY_DATABASE_URI": uri}).testing
+
+
+def test_startup_timings(app):
+    timings = app.extensions["startup_timings"]
+    assert set(timings) == {"config", "imports", "blueprints", "database",
+            "total"}
+    assert timings["total"] >= timings["database"] >= 0
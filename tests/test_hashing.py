@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from mensable import create_app
+from mensable.hashing import HashingBusy, full_method, password_hasher
+from mensable.models import User
+
+
+def test_full_method():
+    assert full_method("scrypt") == "scrypt:32768:8:1"
+    assert full_method("scrypt:16384") == "scrypt:16384:8:1"
+    assert full_method("pbkdf2:sha256:1000") == "pbkdf2:sha256:1000"
+
+
+def test_process_pool():
+    create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PASSWORD_HASH_WORKERS": 1, "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000"})
+    try:
+        password_hash = password_hasher.hash("testpwd")
+        assert password_hash.startswith("pbkdf2:sha256:1000$")
+        assert password_hasher.check(password_hash, "testpwd")
+        assert not password_hasher.check(password_hash, "wrongpwd")
+    finally:
+        password_hasher.shutdown()
+
+
+def test_queue_limit():
+    config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PASSWORD_HASH_WORKERS": 1, "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000"}
+    # The default limit leaves one of the worker's threads free.
+    app = create_app(config)
+    assert app.config["PASSWORD_HASH_QUEUE_LIMIT"] == 3
+    # No limit at all.
+    create_app(dict(config, PASSWORD_HASH_QUEUE_LIMIT=0))
+    try:
+        assert password_hasher.hash("testpwd").startswith("pbkdf2:sha256:1000$")
+    finally:
+        password_hasher.shutdown()
+
+
+def test_busy(app, client, auth, monkeypatch):
+    auth.register()
+    auth.logout()
+
+    # With no room in the queue, requests are turned away without hashing.
+    monkeypatch.setattr(password_hasher, "workers", 1)
+    monkeypatch.setattr(password_hasher, "_slots", threading.BoundedSemaphore(1))
+    password_hasher._slots.acquire()
+    with pytest.raises(HashingBusy):
+        password_hasher.hash("testpwd")
+    response = auth.login()
+    assert response.status_code == 503
+    assert b"The server is busy" in response.data
+    response = auth.register("otheruser")
+    assert response.status_code == 503
+
+
+def test_rehash_on_login(app, auth, monkeypatch):
+    monkeypatch.setattr(password_hasher, "method", "pbkdf2:sha256:1000")
+    auth.register()
+    auth.logout()
+    with app.app_context():
+        old_hash = User.query.first().password_hash
+    assert old_hash.startswith("pbkdf2:sha256:1000$")
+
+    # Logging in again after the method changes upgrades the hash.
+    monkeypatch.setattr(password_hasher, "method", "scrypt")
+    assert auth.login().headers["Location"] == "/"
+    with app.app_context():
+        new_hash = User.query.first().password_hash
+    assert new_hash.startswith("scrypt:32768:8:1$")
+    assert not password_hasher.needs_rehash(new_hash)
+
+    # A wrong password leaves the hash alone.
+    monkeypatch.setattr(password_hasher, "method", "pbkdf2:sha256:1000")
+    auth.logout()
+    auth.login(password="wrongpwd")
+    with app.app_context():
+        assert User.query.first().password_hash == new_hash
+
+
+def test_busy_rehash(app, auth, monkeypatch):
+    monkeypatch.setattr(password_hasher, "method", "pbkdf2:sha256:1000")
+    auth.register()
+    auth.logout()
+    with app.app_context():
+        old_hash = User.query.first().password_hash
+
+    # The password is checked, so a busy hasher only postpones the upgrade.
+    def busy_hash(password):
+        raise HashingBusy()
+    monkeypatch.setattr(password_hasher, "method", "scrypt")
+    monkeypatch.setattr(password_hasher, "hash", busy_hash)
+    assert auth.login().headers["Location"] == "/"
+    with app.app_context():
+        assert User.query.first().password_hash == old_hash
@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from mensable import api as api_module, create_app, db
+from mensable.jobs import job_runner
+from mensable.leitner import utcnow
+from mensable.models import *
+
+
+def test_job_status(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    client.post(f"/delete_table/{api.language_name}/{api.table_name}")
+
+    response = client.get("/jobs/1?format=json")
+    assert response.json["state"] == "done"
+    assert response.json["kind"] == "delete_table"
+    assert client.get("/jobs/2").status_code == 404
+
+    # Only the user who started a job can see it.
+    auth.logout()
+    auth.register("other_user", "123", "123")
+    assert client.get("/jobs/1").status_code == 404
+
+
+def test_resume_stale_job(app, auth, api, monkeypatch):
+    auth.register()
+    api.add_full_stack()
+    monkeypatch.setattr(api_module, "IMPORT_BATCH_SIZE", 2)
+
+    with app.app_context():
+        table = Table.query.filter_by(name=api.table_name).first()
+        params = {"table_id": table.id, "description": "", "next": "/"}
+        rows = "".join(f"word{n},translation{n}\n" for n in range(5))
+        # A job whose worker died after committing its first batch, and one
+        # still running elsewhere.
+        stale = Job("import_csv", 1, params, rows)
+        stale.state, stale.progress, stale.total = "running", 2, 5
+        stale.result = {"added": 2, "reused": 0, "rejected": 0}
+        stale.heartbeat_at = utcnow() - timedelta(minutes=5)
+        running = Job("import_csv", 1, params, rows)
+        running.state, running.heartbeat_at = "running", utcnow()
+        db.session.add_all([stale, running])
+        db.session.commit()
+
+        job_runner.resume()
+        db.session.expire_all()
+        assert (stale.state, stale.progress) == ("done", 5)
+        assert stale.result == {"added": 5, "reused": 0, "rejected": 0}
+        assert running.state == "running"
+        # The resumed job skipped the rows its first run imported.
+        assert len(table.words) == 4
+
+
+def test_failed_job(app, client, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    with app.app_context():
+        job = Job("import_csv", 1, {"table_id": 99, "next": "/"}, "a,b\n")
+        job.created_at = utcnow() - timedelta(minutes=5)
+        db.session.add(job)
+        db.session.commit()
+        job_runner.resume()
+        db.session.expire_all()
+        assert job.state == "failed"
+        assert job.error == "The table has been deleted."
+        assert job.finished_at is not None
+    assert b"The table has been deleted." in client.get("/jobs/1").data
+
+
+def test_resume_only_stale_jobs(tmp_path):
+    config = {"TESTING": True, "PASSWORD_HASH_WORKERS": 0, "JOB_WORKERS": 0,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/jobs.db"}
+    app = create_app(config)
+    with app.app_context():
+        queued = Job("delete_table", None, {"table_id": 1})
+        old = Job("delete_table", None, {"table_id": 1})
+        old.created_at = utcnow() - timedelta(minutes=5)
+        db.session.add_all([queued, old])
+        db.session.commit()
+
+    # Starting another app, or running a command, leaves jobs alone.
+    app = create_app(config)
+    assert app.test_cli_runner().invoke(args=["collect-orphans"]).exit_code == 0
+    with app.app_context():
+        assert [job.state for job in Job.query.order_by(Job.id)] == [
+                "queued", "queued"]
+
+        # A job that has just been queued is left to the worker that queued
+        # it; one that has waited too long is taken over.
+        job_runner.resume()
+        assert [job.state for job in Job.query.order_by(Job.id)] == [
+                "queued", "done"]
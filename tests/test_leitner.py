@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import text
+
+from mensable import db
+from mensable.leitner import (BOX_INTERVALS, due_word_ids, update_boxes,
+        utcnow)
+from mensable.models import *
+
+
+def test_boxes_follow_table(app, client, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # A second user subscribes, then more words are added to the table.
+    auth.logout()
+    auth.register("new_user", "123", "123")
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+    auth.logout()
+    auth.login()
+    api.add_word_pair("foo", "bar")
+
+    with app.app_context():
+        assert LeitnerBox.query.count() == 4
+        word_pair = WordPair.query.filter_by(foreignWord="foo").first()
+        client.post(f"/delete_word/{api.language_name}/{api.table_name}",
+                data={"word_pair_id": word_pair.id})
+        assert LeitnerBox.query.count() == 2
+
+
+def test_due_word_ids(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+    for n in range(5):
+        api.add_word_pair(f"word{n}", f"translation{n}")
+
+    with app.app_context():
+        sub = Subscription.query.first()
+        ids = [word_pair.id for word_pair in WordPair.query.order_by(WordPair.id)]
+        update_boxes(sub, ids[:4], [])
+        update_boxes(sub, ids[:2], [ids[5]])
+        db.session.commit()
+
+        # Boxes: 2 (ids 0, 1), 1 (ids 2, 3), 0 (ids 4, 5), each due after its
+        # box's interval.
+        boxes = {box.word_pair_id: box for box in LeitnerBox.query}
+        assert [boxes[word_id].box for word_id in ids] == [2, 2, 1, 1, 0, 0]
+        now = utcnow()
+        assert boxes[ids[5]].due_at <= now
+        assert (boxes[ids[2]].due_at - now - BOX_INTERVALS[1]).total_seconds() < 60
+
+        # Due word pairs come first, the never-quizzed id 4 before the
+        # just-missed id 5, then those due soonest.
+        assert due_word_ids(sub, 2) == [ids[4], ids[5]]
+        assert set(due_word_ids(sub, 4)[2:]) == {ids[2], ids[3]}
+
+
+def test_updates_batched(app, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    for n in range(14):
+        api.add_word_pair(f"word{n}", f"translation{n}")
+
+    with app.app_context():
+        sub = Subscription.query.first()
+        ids = [word_pair.id for word_pair in WordPair.query.order_by(WordPair.id)]
+        update_boxes(sub, ids[:10], ids[10:])
+        with max_queries(2):
+            db.session.flush()
+
+
+def test_selection_uses_index(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # Selection must be a range scan of the queue index with no sort step, so
+    # its cost does not grow with the size of the table.
+    with app.app_context():
+        plan = db.session.execute(text("EXPLAIN QUERY PLAN "
+                "SELECT word_pair_id FROM leitner_box WHERE subscription_id = 1 "
+                "ORDER BY due_at, shuffle_key LIMIT 6")).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_leitner_box_due" in details
+        assert "TEMP B-TREE" not in details
+
+
+def test_home_due_counts(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    assert b"1 word due" in client.get("/").data
+
+    # A word answered correctly is not due again until tomorrow.
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+    api.quiz_response()
+    client.get(f"/results/{api.language_name}/{api.table_name}")
+    assert b"0 words due" in client.get("/").data
+
+
+def test_timestamps_from_python(app, client, auth, api, max_queries):
+    # Times are taken in UTC by the app, not from the database's clock,
+    # which may be set to local time.
+    auth.register()
+    with max_queries(100) as statements:
+        api.add_full_stack()
+        client.get(f"/quiz/{api.language_name}/{api.table_name}")
+        api.quiz_response("Dunno")
+        client.get(f"/results/{api.language_name}/{api.table_name}")
+    assert not [statement for statement in statements
+            if "CURRENT_TIMESTAMP" in statement]
+
+    with app.app_context():
+        now = utcnow()
+        assert abs(LeitnerBox.query.one().due_at - now).total_seconds() < 60
+        assert abs(QuizAttempt.query.one().taken_at - now).total_seconds() < 60
@@ -0,0 +1,81 @@
+import json
+import os
+
+from mensable import create_app
+from mensable.metrics import Metrics, collect, retire_worker
+
+
+def test_metrics(client, auth):
+    auth.register()
+    auth.login()
+    client.get("/")
+    client.get("/")
+    client.get("/no_such_page")
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'mensable_requests_total{endpoint="api.home",method="GET",' \
+            'status="200"} 2' in text
+    assert 'mensable_requests_total{endpoint="auth.login",method="POST",' \
+            'status="302"} 1' in text
+    assert 'mensable_requests_total{endpoint="unmatched",method="GET",' \
+            'status="404"} 1' in text
+    assert 'mensable_request_duration_seconds_count{endpoint="api.home"} 2' \
+            in text
+    assert 'mensable_request_duration_seconds_bucket{endpoint="api.home",' \
+            'le="+Inf"} 2' in text
+    # The home page looks up the user and their subscriptions.
+    assert 'mensable_sql_statements_bucket{endpoint="api.home",le="0"} 0' \
+            in text
+    assert 'mensable_sql_statements_count{endpoint="api.home"} 2' in text
+    assert "mensable_word_pair_cache_hits_total" in text
+
+
+def test_metrics_across_workers(tmp_path):
+    # Counts written by another worker are added to this worker's own.
+    other = {"requests": {"api.home": {"GET": {"200": 3}}},
+             "histograms": {"sql_statements": {"api.home": {
+                 "buckets": [0, 0, 3] + [0] * 9, "sum": 6, "count": 3}}},
+             "word_pair_cache": {"hits": 5, "misses": 1, "size": 1}}
+    (tmp_path / "metrics-1.json").write_text(json.dumps(other))
+
+    app = create_app({"TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PASSWORD_HASH_WORKERS": 0, "METRICS_DIR": str(tmp_path), "METRICS_DUMP_INTERVAL": 0})
+    client = app.test_client()
+    client.get("/")
+
+    assert os.path.exists(tmp_path / f"metrics-{os.getpid()}.json")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'mensable_requests_total{endpoint="api.home",method="GET",' \
+            'status="302"} 1' in text
+    assert 'mensable_requests_total{endpoint="api.home",method="GET",' \
+            'status="200"} 3' in text
+    assert 'mensable_sql_statements_count{endpoint="api.home"} 4' in text
+    assert "mensable_word_pair_cache_hits_total 5" in text
+
+
+def test_retire_worker(tmp_path):
+    snapshot = {"requests": {"api.home": {"GET": {"200": 3}}},
+             "histograms": {},
+             "word_pair_cache": {"hits": 5, "misses": 1, "size": 7}}
+    for pid in [1, 2]:
+        (tmp_path / f"metrics-{pid}.json").write_text(json.dumps(snapshot))
+    metrics = Metrics()
+
+    # Counters are kept once their workers exit, but not the gauge.
+    retire_worker(str(tmp_path), 1)
+    retire_worker(str(tmp_path), 2)
+    assert sorted(os.listdir(tmp_path)) == ["metrics-retired.json"]
+    totals = collect(metrics, str(tmp_path))
+    assert totals["requests"]["api.home"]["GET"]["200"] == 6
+    assert totals["word_pair_cache"]["hits"] == 10
+    assert totals["word_pair_cache"]["size"] == metrics.snapshot()[
+            "word_pair_cache"]["size"]
+
+    # A new worker reusing a pid adds to the totals.
+    (tmp_path / "metrics-1.json").write_text(json.dumps(snapshot))
+    totals = collect(metrics, str(tmp_path))
+    assert totals["requests"]["api.home"]["GET"]["200"] == 9
+
+    # Retiring a worker that never wrote its counts does nothing.
+    retire_worker(str(tmp_path), 3)
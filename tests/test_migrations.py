@@ -0,0 +1,221 @@
+import pytest
+
+from sqlalchemy import inspect, text
+
+from mensable import db
+from mensable.migrations import (add_missing_columns, backfill_leitner_boxes,
+        create_missing_indexes, get_schema_version, init_schema,
+        migrate_last_quiz_results, migrate_leitner_boxes, update_foreign_keys,
+        upgrade, SCHEMA_VERSION)
+from mensable.models import *
+
+
+def test_migrate_leitner_boxes(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+    api.add_word_pair("foo", "bar")
+
+    # Write a legacy pickled dictionary, including a word no longer in the
+    # table.
+    with app.app_context():
+        sub = Subscription.query.first()
+        foo = WordPair.query.filter_by(foreignWord="foo").first()
+        testo = WordPair.query.filter_by(foreignWord=api.foreignWord).first()
+        sub.leitner_boxes = {foo.id: 3, testo.id: 1, 999: 2}
+        db.session.commit()
+        foo_id, testo_id = foo.id, testo.id
+
+    with app.app_context():
+        assert migrate_leitner_boxes() == 1
+        boxes = {box.word_pair_id: box.box for box in LeitnerBox.query}
+        assert boxes == {foo_id: 3, testo_id: 1}
+        assert Subscription.query.first().leitner_boxes is None
+
+        # Running again changes nothing.
+        assert migrate_leitner_boxes() == 0
+        assert LeitnerBox.query.count() == 2
+
+
+def test_migrate_last_quiz_results(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+    api.create_table("OtherTable")
+
+    # Write legacy pickled results holding WordPair objects, and one that no
+    # longer loads.
+    with app.app_context():
+        sub, other = Subscription.query.order_by(Subscription.id).all()
+        testo = WordPair.query.filter_by(foreignWord=api.foreignWord).first()
+        sub.last_quiz_results = {"total_count": 1, "right_count": 1,
+                "wrong_list": [], "right_list": [testo], "percentage_score": 100,
+                "headline": "Congrats!"}
+        db.session.commit()
+        db.session.execute(text("UPDATE subscription SET last_quiz_results = "
+                "x'00' WHERE id = :id"), {"id": other.id})
+        db.session.commit()
+        testo_id = testo.id
+
+    with app.app_context():
+        assert migrate_last_quiz_results() == 2
+        sub, other = Subscription.query.order_by(Subscription.id).all()
+        assert sub.last_quiz_record == {"v": 1, "wrong": [], "right": [testo_id],
+                "total_count": 1, "right_count": 1}
+        assert sub.last_percentage_score == 100
+        assert (other.last_quiz_record, other.last_percentage_score) == (None,
+                None)
+        assert db.session.execute(text("SELECT count(*) FROM subscription "
+                "WHERE last_quiz_results IS NOT NULL")).scalar() == 0
+        assert migrate_last_quiz_results() == 0
+
+
+def test_upgrade_command(app):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["db-upgrade"])
+    assert result.exit_code == 0
+    assert "leitner_boxes: 0" in result.output
+
+
+def test_add_missing_columns_and_indexes(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # Recreate the leitner_box schema from before shuffle_key and due_at
+    # existed.
+    with app.app_context():
+        db.session.execute(text("DROP INDEX ix_leitner_box_due"))
+        db.session.execute(text("DROP INDEX ix_leitner_box_learner_due"))
+        db.session.execute(text("ALTER TABLE leitner_box DROP COLUMN shuffle_key"))
+        db.session.execute(text("ALTER TABLE leitner_box DROP COLUMN due_at"))
+        db.session.execute(text("CREATE INDEX ix_leitner_box_subscription_box "
+                "ON leitner_box (subscription_id, box)"))
+        db.session.commit()
+
+    with app.app_context():
+        assert add_missing_columns() == 2
+        assert create_missing_indexes() == 2
+        inspector = inspect(db.engine)
+        indexes = [index["name"] for index in inspector.get_indexes("leitner_box")]
+        assert sorted(indexes) == ["ix_leitner_box_due",
+                "ix_leitner_box_learner_due", "ix_leitner_box_word_pair_id"]
+        assert LeitnerBox.query.filter(LeitnerBox.shuffle_key.is_(None)).count() == 0
+        assert LeitnerBox.query.filter(LeitnerBox.due_at.is_(None)).count() == 0
+
+        # Both steps are idempotent.
+        assert add_missing_columns() == 0
+        assert create_missing_indexes() == 0
+
+
+def test_backfill_leitner_boxes(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+    api.add_word_pair("foo", "bar")
+
+    with app.app_context():
+        LeitnerBox.query.delete()
+        db.session.commit()
+        assert backfill_leitner_boxes() == 2
+        assert backfill_leitner_boxes() == 0
+
+
+def test_upgrade_adds_lookup_indexes(app, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # Recreate a database from before the lookup indexes, with a duplicate
+    # subscription that would block the unique index.
+    with app.app_context():
+        for name in ["ix_subscription_learner_table", "ix_subscription_table_id",
+                "ix_word_pair_language_foreign_word",
+                "ix_table_word_pair_table_word", "ix_table_word_pair_word_pair_id"]:
+            db.session.execute(text(f"DROP INDEX {name}"))
+        db.session.execute(text("INSERT INTO subscription (learner_id, table_id, "
+                "quiz_attempts) VALUES (1, 1, 0)"))
+        db.session.commit()
+
+    with app.app_context():
+        counts = upgrade()
+        assert counts["duplicate_subscriptions"] == 1
+        assert counts["indexes"] == 5
+        assert Subscription.query.count() == 1
+
+        # Running again changes nothing.
+        counts = upgrade()
+        assert set(counts.values()) == {0}
+
+        plan = db.session.execute(text("EXPLAIN QUERY PLAN SELECT id FROM "
+                "word_pair WHERE language_id = 1 AND foreignWord = 'x'")).fetchall()
+        assert "ix_word_pair_language_foreign_word" in plan[0][-1]
+
+
+def test_init_schema(app, max_queries):
+    # The app was created against an empty database.
+    assert app.extensions["schema"] == "created"
+    with app.app_context():
+        assert get_schema_version() == SCHEMA_VERSION
+
+        # A later start only reads the schema version.
+        with max_queries(1):
+            assert init_schema() == "current"
+
+        # A database whose version was never recorded is left to db-upgrade.
+        SchemaVersion.query.delete()
+        db.session.commit()
+        assert init_schema() == "outdated"
+        upgrade()
+        assert get_schema_version() == SCHEMA_VERSION
+
+
+def test_update_foreign_keys(app, client, auth, api):
+    auth.register()
+    api.add_full_stack()
+
+    # Recreate table_word_pair and subscription as they were before their
+    # foreign keys cascaded.
+    with app.app_context():
+        db.session.commit()
+        connection = db.session.connection()
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        for name in ["table_word_pair", "subscription"]:
+            create = connection.exec_driver_sql("SELECT sql FROM sqlite_master "
+                    f"WHERE name = '{name}'").scalar()
+            for index in inspect(connection).get_indexes(name):
+                connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+            for statement in [create.replace(" ON DELETE CASCADE", "")
+                        .replace(f"TABLE {name}", f"TABLE old_{name}"),
+                    f"INSERT INTO old_{name} SELECT * FROM {name}",
+                    f"DROP TABLE {name}",
+                    f"ALTER TABLE old_{name} RENAME TO {name}"]:
+                connection.exec_driver_sql(statement)
+        db.session.commit()
+        db.session.connection().exec_driver_sql("PRAGMA foreign_keys=ON")
+
+    with app.app_context():
+        assert update_foreign_keys() == 2
+        assert update_foreign_keys() == 0
+        inspector = inspect(db.engine)
+        rules = [fk["options"].get("ondelete")
+                for fk in inspector.get_foreign_keys("table_word_pair")]
+        assert rules == ["CASCADE", "CASCADE"]
+        # The rebuilt tables have their own index names, so creating indexes
+        # finds nothing missing.
+        assert sorted(index["name"] for index in
+                inspector.get_indexes("table_word_pair")) == [
+                "ix_table_word_pair_table_word",
+                "ix_table_word_pair_word_pair_id"]
+        assert sorted(index["name"] for index in
+                inspector.get_indexes("subscription")) == [
+                "ix_subscription_learner_table", "ix_subscription_table_id"]
+        assert create_missing_indexes() == 0
+        # Other tables still refer to the rebuilt ones.
+        assert [fk["referred_table"] for fk in
+                inspector.get_foreign_keys("leitner_box")
+                if fk["constrained_columns"] == ["subscription_id"]] == [
+                "subscription"]
+        assert db.session.query(table_word_pair).count() == 1
+        assert Subscription.query.count() == 1
+
+    # Deleting the table now removes its links and its orphaned word.
+    client.post(f"/delete_table/{api.language_name}/{api.table_name}")
+    with app.app_context():
+        assert db.session.query(table_word_pair).count() == 0
+        assert WordPair.query.count() == 0
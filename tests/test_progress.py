@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from mensable import db
+from mensable.leitner import utcnow
+from mensable.models import *
+from mensable.progress import daily_progress, overall_progress, table_progress
+
+
+def test_quiz_adds_attempt(app, client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    client.get(f"/quiz/{api.language_name}/{api.table_name}")
+    api.quiz_response()
+    client.get(f"/results/{api.language_name}/{api.table_name}")
+
+    with app.app_context():
+        attempt = QuizAttempt.query.one()
+        assert (attempt.total_count, attempt.right_count) == (1, 1)
+    assert b"1/1 questions correctly (100%)" in client.get("/progress").data
+
+
+def test_no_history(client, auth):
+    auth.register()
+    response = client.get("/progress")
+    assert response.status_code == 200
+    assert b"You have not finished any quizzes" in response.data
+
+
+def test_rollups(app, client, auth, api, max_queries):
+    auth.register()
+    auth.logout()
+    auth.register("other_user", "123", "123")
+    auth.logout()
+    auth.login()
+    api.add_full_stack()
+    api.create_table("OtherTable")
+
+    # A year of history: two quizzes a day on TestTable, one on OtherTable
+    # every other day.
+    with app.app_context():
+        table = Table.query.filter_by(name=api.table_name).first()
+        other = Table.query.filter_by(name="OtherTable").first()
+        now = utcnow()
+        attempts = []
+        for days in range(365):
+            taken_at = now - timedelta(days=days)
+            attempts += [{"user_id": 1, "table_id": table.id,
+                "taken_at": taken_at, "total_count": 6, "right_count": 3}] * 2
+            if days % 2 == 0:
+                attempts.append({"user_id": 1, "table_id": other.id,
+                    "taken_at": taken_at, "total_count": 6, "right_count": 6})
+        # Attempts by other users or from over a year ago are left out.
+        attempts.append({"user_id": 2, "table_id": table.id, "taken_at": now,
+            "total_count": 6, "right_count": 0})
+        attempts.append({"user_id": 1, "table_id": table.id,
+            "taken_at": now - timedelta(days=400), "total_count": 6,
+            "right_count": 0})
+        db.session.execute(QuizAttempt.__table__.insert(), attempts)
+        db.session.commit()
+
+        since = now - timedelta(days=366)
+        days = daily_progress(1, since)
+        assert len(days) == 365
+        assert days[0].day == now.date()
+        assert (days[0].quizzes, days[0].questions, days[0].right,
+                days[0].accuracy) == (3, 18, 12, 66)
+        assert (days[1].quizzes, days[1].accuracy) == (2, 50)
+
+        tables = table_progress(1, since)
+        assert [(row.table_name, row.quizzes, row.accuracy)
+                for row in tables] == [("TestTable", 730, 50),
+                        ("OtherTable", 183, 100)]
+        assert overall_progress(1, since).quizzes == 913
+
+    # Deleting a table keeps its attempts.
+    client.post(f"/delete_table/{api.language_name}/OtherTable")
+    with app.app_context():
+        assert QuizAttempt.query.count() == 915
+        tables = table_progress(1, now - timedelta(days=366))
+        assert tables[1].table_name is None
+
+    with max_queries(4):
+        response = client.get("/progress")
+    assert response.status_code == 200
+    assert b"Deleted tables" in response.data
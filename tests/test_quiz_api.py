@@ -0,0 +1,99 @@
+import pytest
+
+from mensable.models import *
+from mensable.quiz_state import quiz_store
+
+
+def test_quiz_api(app, client, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    api.add_word_pair("foo", "bar")
+    api.add_word_pair("baz", "qux")
+
+    response = client.post(f"/api/quiz/{api.language_name}/{api.table_name}")
+    assert response.status_code == 200
+    quiz_id = response.json["quiz_id"]
+    questions = {question["foreignWord"]: question["id"]
+            for question in response.json["questions"]}
+    assert set(questions) == {api.foreignWord, "foo", "baz"}
+
+    # Answer two correctly (one with a typo) and leave one out.
+    answers = {str(questions[api.foreignWord]): api.translation,
+               str(questions["foo"]): "bra"}
+    with max_queries(9):
+        response = client.post(f"/api/quiz/{quiz_id}/answers",
+                json={"answers": answers})
+    assert response.status_code == 200
+    assert response.json["right_count"] == 2
+    assert response.json["total_count"] == 3
+    assert response.json["percentage_score"] == 66
+    assert sorted(response.json["right"]) == sorted([questions[api.foreignWord],
+        questions["foo"]])
+    assert response.json["wrong"] == [{"id": questions["baz"],
+        "foreignWord": "baz", "translation": "qux"}]
+
+    with app.app_context():
+        boxes = {box.word_pair_id: box.box for box in LeitnerBox.query}
+        assert boxes == {questions[api.foreignWord]: 1, questions["foo"]: 1,
+                questions["baz"]: 0}
+        assert Subscription.query.first().quiz_attempts == 1
+
+    # The quiz can only be submitted once.
+    response = client.post(f"/api/quiz/{quiz_id}/answers",
+            json={"answers": answers})
+    assert response.status_code == 404
+
+
+def test_quiz_api_errors(client, auth, api):
+    route = f"/api/quiz/{api.language_name}/{api.table_name}"
+    assert client.post(route).status_code == 401
+
+    auth.register()
+    assert client.post(route).status_code == 404
+    api.add_full_stack()
+    quiz_id = client.post(route).json["quiz_id"]
+    assert client.post(f"/api/quiz/{quiz_id}/answers",
+            json={"answers": []}).status_code == 400
+
+    # Another user cannot submit answers to the quiz.
+    auth.logout()
+    auth.register("new_user", "123", "123")
+    assert client.post(f"/api/quiz/{quiz_id}/answers",
+            json={"answers": {}}).status_code == 404
+
+
+def test_double_submission(app, client, auth, api, monkeypatch):
+    auth.register()
+    api.add_full_stack()
+    response = client.post(f"/api/quiz/{api.language_name}/{api.table_name}")
+    quiz_id = response.json["quiz_id"]
+    answers = {"answers": {str(response.json["questions"][0]["id"]):
+        api.translation}}
+
+    # A second submission that read the quiz before the first claimed it.
+    with app.app_context():
+        quiz = quiz_store.get(quiz_id)
+    assert client.post(f"/api/quiz/{quiz_id}/answers",
+            json=answers).status_code == 200
+    monkeypatch.setattr(quiz_store, "get", lambda quiz_id: quiz)
+    assert client.post(f"/api/quiz/{quiz_id}/answers",
+            json=answers).status_code == 409
+
+    with app.app_context():
+        assert Subscription.query.first().quiz_attempts == 1
+        assert QuizAttempt.query.count() == 1
+        assert LeitnerBox.query.first().box == 1
+
+
+def test_unsubscribed_mid_quiz(client, auth, api):
+    auth.register()
+    api.add_full_stack()
+    quiz_id = client.post(
+            f"/api/quiz/{api.language_name}/{api.table_name}").json["quiz_id"]
+    client.post(f"/unsubscribe/{api.language_name}/{api.table_name}")
+
+    response = client.post(f"/api/quiz/{quiz_id}/answers",
+            json={"answers": {}})
+    assert response.status_code == 409
+    assert client.post(f"/api/quiz/{quiz_id}/answers",
+            json={"answers": {}}).status_code == 404
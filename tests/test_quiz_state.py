@@ -0,0 +1,55 @@
+import pytest
+from flask import session
+
+from mensable.quiz_state import MemoryQuizStore, SQLQuizStore
+
+
+@pytest.mark.parametrize("backend", [MemoryQuizStore, SQLQuizStore])
+def test_store(app, backend):
+    with app.app_context():
+        store = backend(ttl=60)
+        quiz = {"table_id": 1, "to_test": [{"id": 1}], "right_list": []}
+        quiz_id = store.create(quiz)
+        assert store.get(quiz_id) == quiz
+
+        # Changes are only seen once saved.
+        quiz["right_list"].append(1)
+        assert store.get(quiz_id)["right_list"] == []
+        store.save(quiz_id, quiz)
+        assert store.get(quiz_id)["right_list"] == [1]
+
+        store.delete(quiz_id)
+        assert store.get(quiz_id) is None
+        assert store.get("unknown") is None
+
+        # Only one caller claims a quiz.
+        quiz_id = store.create(quiz)
+        assert store.claim(quiz_id)
+        assert not store.claim(quiz_id)
+
+
+@pytest.mark.parametrize("backend", [MemoryQuizStore, SQLQuizStore])
+def test_store_expiry(app, backend):
+    with app.app_context():
+        store = backend(ttl=-1)
+        quiz_id = store.create({"table_id": 1})
+        assert store.get(quiz_id) is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sql"])
+def test_session_holds_only_quiz_id(client, auth, api, backend):
+    client.application.config["QUIZ_STATE_BACKEND"] = backend
+    from mensable.quiz_state import quiz_store
+    quiz_store.init_app(client.application)
+
+    auth.register()
+    api.add_full_stack()
+    route = f"/quiz/{api.language_name}/{api.table_name}"
+    with client:
+        client.get(route)
+        assert "quiz_id" in session
+        assert "quiz" not in session
+        assert client.get(route).status_code == 200
+        api.quiz_response()
+        assert client.get(route).headers["Location"] == \
+                f"/results/{api.language_name}/{api.table_name}"
@@ -0,0 +1,115 @@
+from mensable import db
+from mensable.migrations import upgrade
+from mensable.models import WordTrigram
+from mensable.quizzes import compare_strings
+from mensable import search
+from mensable.search import search_word_pairs, trigrams
+
+
+def test_trigrams():
+    assert trigrams("Ab c") == {"  a", " ab", "abc", "bc "}
+
+
+def test_search(client, auth, api):
+    auth.register()
+    api.add_full_stack("Hund", "Dog")
+    api.add_word_pair("Katze", "Cat")
+    api.add_word_pair("Pferdchen", "Little horse")
+    api.add_full_stack("Hond", "Dog", language_name="Otherese",
+            table_name="OtherTable")
+
+    html = client.get("/search?q=katz").get_data(as_text=True)
+    assert "Katze" in html and "Hund" not in html
+
+    # Matches are as lenient as quiz answers, on either side of the pair.
+    html = client.get("/search?q=pferdchn").get_data(as_text=True)
+    assert "Pferdchen" in html
+    html = client.get("/search?q=littlehorse").get_data(as_text=True)
+    assert "Pferdchen" in html
+
+    html = client.get("/search?q=hund").get_data(as_text=True)
+    assert "Hund" in html and "Hond" in html
+    html = client.get("/search?q=hund&language=Otherese").get_data(as_text=True)
+    assert "Hund" not in html and "Hond" in html
+    html = client.get("/search?q=hund&table=TestTable").get_data(as_text=True)
+    assert "Hund" in html and "Hond" not in html
+
+    html = client.get("/search?q=hund&language=Nolang").get_data(as_text=True)
+    assert "does not exist" in html
+    html = client.get("/search?q=xylophone").get_data(as_text=True)
+    assert "No matching words found." in html
+
+
+def test_search_order(app, auth, api):
+    auth.register()
+    # "abcdxy" shares more trigrams with the query, but "xbcd" is closer.
+    api.add_full_stack("abcdxy", "one")
+    api.add_word_pair("xbcd", "two")
+    api.add_word_pair("abcd", "three")
+
+    with app.app_context():
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("abcd")] == ["abcd", "xbcd", "abcdxy"]
+
+
+def test_short_queries(app, auth, api):
+    auth.register()
+    api.add_full_stack("xatxe", "one")
+    api.add_word_pair("kxtxe", "two")
+    api.add_word_pair("xatxeln", "three")
+
+    with app.app_context():
+        # Both are within the tolerance of "katze", but "xatxe" shares none
+        # of its trigrams, so is not found.
+        assert compare_strings("katze", "xatxe")
+        assert search.SHORT_QUERY == 5
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("katze")] == ["kxtxe"]
+        # A longer query has trigrams in common with every match.
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("katzeln")] == ["xatxeln"]
+
+
+def test_search_index_maintenance(app, client, auth, api):
+    auth.register()
+    api.add_full_stack("Katze", "Cat")
+    with app.app_context():
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("katze")] == ["Katze"]
+
+    client.post(f"/delete_word/{api.language_name}/{api.table_name}",
+            data={"word_pair_id": 1})
+    with app.app_context():
+        assert search_word_pairs("katze") == []
+        assert WordTrigram.query.count() == 0
+
+    # Word pairs from before the index existed are indexed by db-upgrade.
+    api.add_word_pair("Maus", "Mouse")
+    with app.app_context():
+        WordTrigram.query.delete()
+        db.session.commit()
+        assert search_word_pairs("maus") == []
+        assert upgrade()["indexed_word_pairs"] == 1
+        assert upgrade()["indexed_word_pairs"] == 0
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("maus")] == ["Maus"]
+
+
+def test_search_skips_common_trigrams(app, auth, api, monkeypatch):
+    auth.register()
+    api.add_full_stack("Katze", "Cat")
+    api.add_word_pair("Kater", "Tomcat")
+    api.add_word_pair("Kasse", "Till")
+
+    # "  k" and " ka" are now too common to read, but the word pairs can
+    # still be found from the rest of their trigrams, closest first.
+    monkeypatch.setattr(search, "COMMON_TRIGRAM", 3)
+    with app.app_context():
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("katse")] == ["Katze", "Kasse", "Kater"]
+
+    # When every trigram is common, the entries of just one are read.
+    monkeypatch.setattr(search, "COMMON_TRIGRAM", 1)
+    with app.app_context():
+        assert [word_pair.foreignWord for word_pair in
+                search_word_pairs("kater")] == ["Kater", "Katze"]
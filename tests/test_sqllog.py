@@ -0,0 +1,60 @@
+import logging
+import subprocess
+import sys
+
+from mensable import create_app
+
+
+def make_app(**config):
+    return create_app({"TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PASSWORD_HASH_WORKERS": 0, **config})
+
+
+def test_slow_queries(caplog):
+    app = make_app(SQL_SLOW_QUERY_MS=0)
+    client = app.test_client()
+    with caplog.at_level(logging.INFO, logger="mensable.sql"):
+        client.post("/register", data={"username": "testuser",
+            "password": "secretpwd", "confirmation": "secretpwd"})
+    records = [r for r in caplog.records if r.name == "mensable.sql"]
+    assert records
+    assert all(r.levelno == logging.WARNING for r in records)
+    assert any("auth.register: INSERT INTO user" in r.getMessage()
+            for r in records)
+    # Parameters are redacted by default.
+    assert not any("secretpwd" in r.getMessage() or "testuser" in
+            r.getMessage() for r in records)
+
+
+def test_logged_once():
+    # Outside pytest, whose own log handlers would hide a duplicate.
+    script = """if True:
+        from mensable import create_app
+        app = create_app({"TESTING": True, "PASSWORD_HASH_WORKERS": 0,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+            "SQL_SLOW_QUERY_MS": 0})
+        app.test_client().post("/register", data={"username": "testuser",
+            "password": "secretpwd", "confirmation": "secretpwd"})
+    """
+    result = subprocess.run([sys.executable, "-c", script],
+            capture_output=True, text=True, check=True)
+    assert result.stderr.count("auth.register: INSERT INTO user") == 1
+
+
+def test_sampled_queries(caplog):
+    app = make_app(SQL_SLOW_QUERY_MS=None, SQL_LOG_SAMPLE_RATE=1.0,
+            SQL_LOG_REDACT=False)
+    client = app.test_client()
+    with caplog.at_level(logging.INFO, logger="mensable.sql"):
+        client.post("/login", data={"username": "nobody", "password": "x"})
+    messages = [r.getMessage() for r in caplog.records
+            if r.name == "mensable.sql" and r.levelno == logging.INFO]
+    assert any("auth.login: SELECT" in message and "'nobody'" in message
+            for message in messages)
+
+
+def test_quiet_by_default(caplog, client, auth):
+    with caplog.at_level(logging.INFO, logger="mensable.sql"):
+        auth.register()
+    assert not [r for r in caplog.records if r.name == "mensable.sql"]
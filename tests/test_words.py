@@ -0,0 +1,61 @@
+import pytest
+
+from mensable.models import *
+from mensable.words import get_word_pair_lists, get_word_pairs, word_pair_cache
+
+
+def test_get_word_pairs(app, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    for n in range(4):
+        api.add_word_pair(f"word{n}", f"translation{n}")
+
+    with app.app_context():
+        ids = [word_pair.id for word_pair in WordPair.query]
+        # Order is kept and unknown ids are skipped, in a single query.
+        with max_queries(1):
+            word_pairs = get_word_pairs([ids[3], 999, ids[0], ids[2]])
+        assert [word_pair.id for word_pair in word_pairs] == [ids[3], ids[0], ids[2]]
+
+        with max_queries(1):
+            wrong, right = get_word_pair_lists([ids[1]], [ids[4], ids[1]])
+        assert [word_pair.id for word_pair in wrong] == [ids[1]]
+        assert [word_pair.id for word_pair in right] == [ids[4], ids[1]]
+
+        with max_queries(0):
+            assert get_word_pair_lists([], []) == [[], []]
+
+
+def test_quiz_answers_need_no_word_queries(client, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+    route = f"/quiz/{api.language_name}/{api.table_name}"
+    client.get(route)
+
+    # Asking and marking a question reads the table and the quiz state, but
+    # no word pairs.
+    with max_queries(6) as statements:
+        assert client.get(route).status_code == 200
+        api.quiz_response()
+    assert not [statement for statement in statements
+            if "FROM word_pair" in statement]
+
+
+def test_word_pair_cache(app, client, auth, api, max_queries):
+    auth.register()
+    api.add_full_stack()
+
+    with app.app_context():
+        word_pair_id = WordPair.query.first().id
+        assert get_word_pairs([word_pair_id])[0].translation == api.translation
+        # A second lookup is served from the cache.
+        with max_queries(0):
+            snapshot = get_word_pairs([word_pair_id])[0]
+        assert snapshot.foreignWord == api.foreignWord
+        assert word_pair_cache.info()["hits"] == 1
+
+    # Deleting the word pair invalidates its snapshot.
+    client.post(f"/delete_word/{api.language_name}/{api.table_name}",
+            data={"word_pair_id": word_pair_id})
+    with app.app_context():
+        assert get_word_pairs([word_pair_id]) == []